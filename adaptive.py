@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# run an iperf3 client and stop it once the throughput has converged
+# usage: adaptive.py [options] --logfile <result.json> -- iperf3 -c ...
+
+import argparse
+import json
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser("Stop iperf3 once the throughput and retransmits are stable")
+    parser.add_argument("--logfile", required=True, type=str, dest="logfile", help="iperf3 JSON result file")
+    parser.add_argument("--window", default=6, type=int, dest="window",
+                        help="Number of interval reports used by the convergence test")
+    parser.add_argument("--tolerance", default=0.05, type=float, dest="tolerance",
+                        help="Maximum relative variation of the throughput within the window")
+    parser.add_argument("--min-time", default=3, type=float, dest="min_time",
+                        help="Minimum number of seconds to measure before stopping")
+    parser.add_argument("iperf3", nargs=argparse.REMAINDER, help="iperf3 client command")
+    args = parser.parse_args(argv)
+    if args.iperf3 and args.iperf3[0] == "--":
+        args.iperf3 = args.iperf3[1:]
+    assert len(args.iperf3) > 0, "iperf3 command is required"
+    return args
+
+
+def is_converged(samples, window, tolerance):
+    # samples are (seconds, bytes, retransmits) of each interval report, omitted intervals excluded
+    if len(samples) < window:
+        return False
+    recent = samples[-window:]
+    throughput = [b / s for s, b, _ in recent if s > 0]
+    if len(throughput) < window:
+        return False
+    mean = statistics.mean(throughput)
+    if mean <= 0 or statistics.pstdev(throughput) / mean > tolerance:
+        return False
+    # the retransmit count has to be stable as well. compare the two halves of the window
+    # and allow one retransmit of slack per interval so that rare losses don't prevent convergence
+    half = window // 2
+    retr1 = sum(r for _, __, r in recent[:half])
+    retr2 = sum(r for _, __, r in recent[-half:])
+    return abs(retr1 - retr2) <= tolerance * max(retr1, retr2) + half
+
+
+def get_sender_summary(intervals):
+    # build an iperf3-style summary from the interval reports
+    samples = [interval["sum"] for interval in intervals if not interval["sum"].get("omitted", False)]
+    seconds = sum(s["seconds"] for s in samples)
+    num_bytes = sum(s["bytes"] for s in samples)
+    retransmits = sum(s.get("retransmits", 0) for s in samples)
+    start = samples[0]["start"] if samples else 0
+    return {"start": start, "end": start + seconds, "seconds": seconds, "bytes": num_bytes,
+            "bits_per_second": num_bytes * 8 / seconds if seconds > 0 else 0, "retransmits": retransmits,
+            "sender": True}
+
+
+def get_stream_rtt(intervals):
+    rtts = [stream["rtt"] for interval in intervals if not interval["sum"].get("omitted", False)
+            for stream in interval["streams"] if "rtt" in stream]
+    if not rtts:
+        return {}
+    return {"min_rtt": min(rtts), "mean_rtt": int(statistics.mean(rtts)), "max_rtt": max(rtts)}
+
+
+def get_end(end, intervals):
+    # if iperf3 got interrupted it never exchanges results with the server, so the receiver side is empty.
+    # in that case use what the sender reported, which counts the bytes in flight as received
+    if end is not None and end.get("sum_received", {}).get("bytes", 0) > 0:
+        return end
+    sum_sent = get_sender_summary(intervals)
+    sum_received = dict(sum_sent)
+    sum_received.pop("retransmits")
+    sum_received["sender"] = False
+    sender = dict(sum_sent)
+    sender.update(get_stream_rtt(intervals))
+    result = dict(end) if end is not None else {}
+    result.update({"streams": [{"sender": sender, "receiver": sum_received}],
+                   "sum_sent": sum_sent, "sum_received": sum_received})
+    return result
+
+
+def run_client(args):
+    start_time = time.time()
+    p = subprocess.Popen(args.iperf3, stdout=subprocess.PIPE, text=True)
+    result = {}
+    intervals = []
+    samples = []
+    end = None
+    converged = False
+    for line in p.stdout:
+        line = line.strip()
+        if not line:
+            continue
+        event = json.loads(line)
+        name = event.get("event")
+        data = event.get("data")
+        if name == "start":
+            result["start"] = data
+        elif name == "interval":
+            intervals.append(data)
+            total = data["sum"]
+            if total.get("omitted", False):
+                continue
+            samples.append((total["seconds"], total["bytes"], total.get("retransmits", 0)))
+            elapsed = sum(s for s, _, __ in samples)
+            if not converged and elapsed >= args.min_time and is_converged(samples, args.window, args.tolerance):
+                converged = True
+                # iperf3 prints the end report when interrupted
+                p.send_signal(signal.SIGINT)
+        elif name == "end":
+            end = data
+        elif name == "error" and not converged:
+            print("iperf3:", data, file=sys.stderr)
+    p.wait()
+    if not converged and p.returncode != 0:
+        return p.returncode
+
+    result["intervals"] = intervals
+    result["end"] = get_end(end, intervals)
+    result["adaptive"] = {"converged": converged, "duration": result["end"]["sum_sent"]["seconds"],
+                          "wall_time": time.time() - start_time, "window": args.window,
+                          "tolerance": args.tolerance}
+    with open(args.logfile, "w+") as f:
+        json.dump(result, f, indent="\t")
+    return 0
+
+
+def main():
+    args = get_args()
+    sys.exit(run_client(args))
+
+
+if __name__ == "__main__":
+    main()
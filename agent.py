@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# control agent that runs on the LAN machines. it takes batches of JSON commands, one request per line, to
+# apply/clear netem and to keep a pool of iperf3 servers warm across experiments
+# usage:
+#   agent.py serve [--socket <path>] [--dry-run]   serve stdin/stdout, or every connection to a unix socket
+#   agent.py connect --socket <path> [--dry-run]   bridge stdin/stdout to the daemon, starting it if needed. a daemon
+#                                                  started by another version of this file is restarted
+#
+# request:  {"id": 1, "commands": [{"op": "netem_apply", "dev": "eth1", "args": ["delay", "10ms"]}, ...]}
+# response: {"id": 1, "results": [{"ok": true, ...}, {"ok": false, "error": "..."}]}
+# this file is copied to the remote machines, so it only uses the standard library
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+# stands in for an iperf3 server in dry runs on machines without iperf3
+_PLACEHOLDER_SERVER = ("import socket, sys, time\n"
+                       "s = socket.socket()\n"
+                       "s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)\n"
+                       "s.bind(('0.0.0.0', int(sys.argv[1])))\n"
+                       "s.listen()\n"
+                       "time.sleep(1e9)\n")
+
+
+def parse_listening_ports(text):
+    # text is the content of /proc/net/tcp and/or /proc/net/tcp6
+    ports = set()
+    for line in text.splitlines():
+        tokens = line.split()
+        # 0A is TCP_LISTEN. this also skips the header lines
+        if len(tokens) > 3 and tokens[3] == "0A":
+            ports.add(int(tokens[1].split(":")[-1], 16))
+    return ports
+
+
+def get_file_hash():
+    with open(os.path.abspath(__file__), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_listening_ports():
+    ports = set()
+    for filename in ["/proc/net/tcp", "/proc/net/tcp6"]:
+        if os.path.exists(filename):
+            with open(filename) as f:
+                ports |= parse_listening_ports(f.read())
+    return ports
+
+
+class Agent:
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        # of the file the agent was started from, which may be replaced while it runs
+        self.hash = get_file_hash()
+        self.servers = {}
+        self.lock = threading.Lock()
+
+    def run_tc(self, args, check=True):
+        commands = ["tc"] + args
+        if os.geteuid() != 0:
+            commands = ["sudo"] + commands
+        if self.dry_run:
+            return {"command": " ".join(commands)}
+        p = subprocess.run(commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if check and p.returncode != 0:
+            raise RuntimeError(f"{' '.join(commands)}: {p.stderr.strip()}")
+        return {"command": " ".join(commands)}
+
+    def netem_apply(self, dev, args):
+        # replace instead of add, so that a leftover qdisc from a crashed run doesn't fail the experiment
+        return self.run_tc(["qdisc", "replace", "dev", dev, "root", "netem"] + [str(a) for a in args])
+
+    def netem_clear(self, dev):
+        return self.run_tc(["qdisc", "del", "dev", dev, "root"], check=False)
+
+    def is_alive(self, port):
+        p = self.servers.get(port)
+        return p is not None and p.poll() is None
+
+    def iperf_start(self, port):
+        # servers are kept running between experiments. iperf3 serves one test after another
+        if self.is_alive(port):
+            return {"reused": True}
+        if shutil.which("iperf3") is not None:
+            commands = ["iperf3", "-s", "-p", str(port), "-4"]
+        else:
+            assert self.dry_run, "iperf3 is not installed"
+            commands = [sys.executable, "-c", _PLACEHOLDER_SERVER, str(port)]
+        self.servers[port] = subprocess.Popen(commands, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return {"reused": False}
+
+    def iperf_check(self, port):
+        return {"alive": self.is_alive(port), "listening": port in get_listening_ports()}
+
+    def iperf_stop(self, port=None):
+        ports = [port] if port is not None else list(self.servers.keys())
+        for p in ports:
+            server = self.servers.pop(p, None)
+            if server is not None:
+                server.kill()
+                server.wait()
+        return {"stopped": ports}
+
+    def ready(self, ports, timeout=5):
+        # wait until all the servers accept connections
+        start = time.time()
+        while True:
+            missing = set(ports) - get_listening_ports()
+            if not missing:
+                return {"latency": time.time() - start}
+            for port in missing:
+                if port in self.servers and not self.is_alive(port):
+                    raise RuntimeError(f"iperf3 server on port {port} exited")
+            if time.time() - start > timeout:
+                raise RuntimeError(f"ports {sorted(missing)} are not listening after {timeout}s")
+            time.sleep(0.01)
+
+    def ping(self):
+        return {"pid": os.getpid(), "hash": self.hash}
+
+    def handle(self, request):
+        results = []
+        with self.lock:
+            for command in request.get("commands", []):
+                command = dict(command)
+                op = command.pop("op")
+                try:
+                    assert op in {"netem_apply", "netem_clear", "iperf_start", "iperf_check", "iperf_stop",
+                                  "ready", "ping"}, f"unknown op {op}"
+                    result = getattr(self, op)(**command)
+                    result["ok"] = True
+                except Exception as ex:
+                    result = {"ok": False, "error": str(ex)}
+                results.append(result)
+        return {"id": request.get("id"), "results": results}
+
+    def serve(self, rfile, wfile):
+        for line in rfile:
+            line = line.strip()
+            if not line:
+                continue
+            response = self.handle(json.loads(line))
+            wfile.write(json.dumps(response) + "\n")
+            wfile.flush()
+
+
+class AgentError(RuntimeError):
+    pass
+
+
+class AgentClient:
+    """Talks to an agent over the stdin/stdout of `commands`, e.g. ssh into a machine and run agent.py connect"""
+    def __init__(self, name, commands, debug=False):
+        self.name = name
+        self.__debug = debug
+        self.__next_id = 0
+        if debug:
+            print(f"{name} agent:", " ".join(commands))
+        self.__p = subprocess.Popen(commands, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def call(self, *commands):
+        """Send a batch of commands in one round trip. Raises AgentError if any of them fails"""
+        self.__next_id += 1
+        request = {"id": self.__next_id, "commands": list(commands)}
+        if self.__debug:
+            print(f"{self.name} agent <", json.dumps(request))
+        self.__p.stdin.write(json.dumps(request) + "\n")
+        self.__p.stdin.flush()
+        line = self.__p.stdout.readline()
+        if not line:
+            raise AgentError(f"{self.name} agent exited with {self.__p.wait()}")
+        response = json.loads(line)
+        if self.__debug:
+            print(f"{self.name} agent >", line.strip())
+        for command, result in zip(commands, response["results"]):
+            if not result["ok"]:
+                raise AgentError(f"{self.name} agent: {command['op']} failed: {result['error']}")
+        return response["results"]
+
+    def close(self):
+        if self.__p.poll() is None:
+            self.__p.stdin.close()
+            try:
+                self.__p.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.__p.kill()
+                self.__p.wait()
+
+
+def get_local_agent_commands(dry_run=False):
+    # runs the agent as a child process, which is also what stands in for remote machines in tests
+    commands = [sys.executable, os.path.abspath(__file__), "serve"]
+    if dry_run:
+        commands.append("--dry-run")
+    return commands
+
+
+def get_remote_agent_commands(path, socket_path, dry_run=False):
+    commands = ["sudo", "python3", path, "connect", "--socket", socket_path]
+    if dry_run:
+        commands.append("--dry-run")
+    return commands
+
+
+def serve_socket(agent, path):
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            with self.request.makefile("r") as rfile, self.request.makefile("w") as wfile:
+                agent.serve(rfile, wfile)
+
+    def stop(signum, frame):
+        # so that the servers get stopped
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        os.chmod(path, 0o600)
+        try:
+            server.serve_forever()
+        finally:
+            agent.iperf_stop()
+
+
+def connect_daemon(path, dry_run):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return sock
+    except (FileNotFoundError, ConnectionRefusedError):
+        pass
+    # start the daemon, which outlives this connection and keeps the servers warm
+    commands = [sys.executable, os.path.abspath(__file__), "serve", "--socket", path]
+    if dry_run:
+        commands.append("--dry-run")
+    subprocess.Popen(commands, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+    for _ in range(500):
+        time.sleep(0.01)
+        try:
+            sock.connect(path)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            continue
+    raise RuntimeError(f"Unable to start the agent on {path}")
+
+
+def ping_daemon(sock):
+    sock.sendall((json.dumps({"id": 0, "commands": [{"op": "ping"}]}) + "\n").encode())
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise RuntimeError("The agent closed the connection")
+        data += chunk
+    return json.loads(data)["results"][0]
+
+
+def stop_daemon(pid, timeout=5):
+    # the daemon stops its servers on SIGTERM
+    os.kill(pid, signal.SIGTERM)
+    for _ in range(int(timeout / 0.01)):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return
+        time.sleep(0.01)
+    os.kill(pid, signal.SIGKILL)
+
+
+def connect(path, dry_run):
+    sock = connect_daemon(path, dry_run)
+    result = ping_daemon(sock)
+    if result.get("hash") != get_file_hash():
+        # a daemon started by an older copy of this file would keep serving the old code
+        sock.close()
+        stop_daemon(result["pid"])
+        sock = connect_daemon(path, dry_run)
+
+    def forward_stdin():
+        for line in sys.stdin.buffer:
+            sock.sendall(line)
+        sock.shutdown(socket.SHUT_WR)
+
+    threading.Thread(target=forward_stdin, daemon=True).start()
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            break
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Experiment control agent")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ["serve", "connect"]:
+        p = subparsers.add_parser(command)
+        p.add_argument("--socket", default="", required=command == "connect", type=str, dest="socket",
+                       help="Unix socket of the agent daemon")
+        p.add_argument("--dry-run", action="store_true", dest="dry_run",
+                       help="Don't run tc, and use placeholder servers if iperf3 is not installed")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.command == "connect":
+        connect(args.socket, args.dry_run)
+        return
+    agent = Agent(args.dry_run)
+    if args.socket:
+        serve_socket(agent, args.socket)
+    else:
+        try:
+            agent.serve(sys.stdin, sys.stdout)
+        finally:
+            agent.iperf_stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,302 +1,157 @@
 import argparse
 import time
-
-import mininet.topo
-import mininet.net
-import mininet.node
-import mininet.link
-import mininet.net
-import mininet.util
-import mininet.clean
-import mininet.log
 import os
-import multiprocessing
+import signal
 import sys
 import subprocess
-import math
-
-from remote import RemoteHost, RemoteSSHLink, RemoteOVSSwitch
-from util import get_iperf_metrics, get_filename, get_available_cc
-
-# MTU - 40 bytes of TCP header size
-PACKET_SIZE = 1500 - 40
-
-
-def get_queue_size(buffer_size):
-    return int(math.ceil(buffer_size * 1000 * 1000 / PACKET_SIZE))
-
-
-class Topology(mininet.topo.Topo):
-    def __init__(self, config):
-        self.config = config
-        # in Section 3.1, the paper mentioned that the delay between h1/h2 and h3 is 40us
-        self._min_delay = "{0}us".format(40 / 2)
-        super(Topology, self).__init__()
-
-    def build(self):
-        # we don't use namespace since it removes the kernel count for tcp transmission
-        h1 = self.addHost("h1", inNamespace=False)
-        h3 = self.addHost("h3", server=self.config.remote_host, user=self.config.remote_user,
-                          port=self.config.remote_host_port, inNamespace=True)
-        s1 = self.addSwitch("s1")
-        # [3.1] Host links have 1Gbps peak BW.
-        self.addLink(h1, s1, bw=1000, delay=self._min_delay)
-        # keyi: need to convert to number of bytes, then divided by the MTU to obtain number of packets
-        # mininet does the following parameter passing to tc:
-        # 'limit %d' % max_queue_size if max_queue_size is not None
-        # which produces the following command (e.g.)
-        # tc qdisc add dev s1-eth2  parent 5:1  handle 10: netem delay 75.0ms limit XX
-        # based on man tc-netem, limit is specified by the number of packets, hence we need
-        # to do a conversion
-        max_queue_size = int(math.ceil(self.config.buffer_size * 1000 * 1000 / PACKET_SIZE))
-        if self.config.debug:
-            print(f"max_queue_size: {max_queue_size}")
-        self.addLink(s1, h3, bw=self.config.bw, delay="{0}ms".format(self.config.rtt / 2),
-                     loss=(self.config.loss * 100) if self.config.loss > 0 else None,
-                     max_queue_size=get_queue_size(self.config.buffer_size),
-                     use_tbf=True)
-
-        if self.config.h2:
-            h2 = self.addHost("h2", inNamespace=False)
-            self.addLink(h2, s1, bw=1000, delay=self._min_delay)
-
-    def get_senders(self):
-        if self.config.h2:
-            return ["h1", "h2"]
-        else:
-            return ["h1"]
-
-
-def get_iperf3_server_commands(port1, port2):
-    # iperf3 only allow one test per server
-    cmd1 = f"iperf3 -s -p {port1} -4"
-    cmd2 = f"iperf3 -s -p {port2} -4"
-    return cmd1, cmd2
-
-
-def setup_mininet_iperf_server(node, port1, port2, configs):
-    cmd1, cmd2 = get_iperf3_server_commands(port1, port2)
-    # prevent blocking
-    if configs.debug:
-        print(node.name + ":", cmd1)
-        node.popen(cmd1, stdout=sys.stdout, stderr=sys.stderr)
-    else:
-        node.popen(cmd1, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    if port2 is not None:
-        if configs.debug:
-            print(node.name + ":", cmd2)
-            node.popen(cmd2, stdout=sys.stdout, stderr=sys.stderr)
-        else:
-            node.popen(cmd2, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
 
-def get_ssh_commands(host, commands, port=22, debug=False, username="mininet", id_file=""):
-    ssh_commands = ["ssh", f"{username}@{host}", "-p", f"{port}"]
-    if len(id_file) > 0:
-        ssh_commands += ["-i", id_file]
-    commands = ssh_commands + commands
-    if debug:
-        print("SSH cmd:", " ".join(commands))
-    return commands
+from agent import AgentClient, get_local_agent_commands, get_remote_agent_commands
+from experiment import get_iperf3_client_cmd, check_output, record_run, get_lan_netem_args, get_lan_ports, \
+    remove_lan_results, get_copy_commands, get_switch_queue_sampler_commands, record_queue_summary, \
+    record_flow_summary, record_journal, timed_phase, wait_for_queue_sampler
+import qdisc
+import tracing
+from sshpool import get_ssh_commands, get_remote_username, REMOTE_AGENT_PATH, REMOTE_AGENT_SOCKET, \
+    REMOTE_SAMPLER_PATH
+from tcpinfo import get_sampler_commands, get_tcpinfo_filename
+from util import get_filename, check_available_cc, check_json_stream, DEFAULT_PORT, MAX_SENDERS
 
 
-def setup_lan_iperf_server(port1, port2, configs):
-    # killall the iperf3 server first
-    if configs.remote_host.split(".")[0] != "10":
-        # username is ubuntu
-        username = "ubuntu"
-    else:
-        username = "mininet"
-
-    commands = get_ssh_commands(configs.remote_host, port=configs.remote_host_port, commands=["killall", "iperf3"],
-                                debug=configs.debug, username=username, id_file=configs.remote_ssh_key)
-    subprocess.call(commands, stderr=sys.stderr if configs.debug else subprocess.DEVNULL)
-
-    cmd1, cmd2 = get_iperf3_server_commands(port1, port2)
-
+def start_lan_clients(configs):
+    # returns the h1 and h2 client processes. h2 is None if not enabled
     processes = []
-    commands = [cmd1, cmd2] if port2 is not None else [cmd1]
-    for cmd in commands:
-        commands = get_ssh_commands(configs.remote_host, cmd.split(), configs.remote_host_port, username=username,
-                                    id_file=configs.remote_ssh_key)
+    hosts = [("h1", configs.cc), ("h2", configs.h2_cc)]
+    for (name, cc), port in zip(hosts, get_lan_ports(configs)):
+        commands = get_iperf3_client_cmd(configs.remote_host, port, get_filename(name, configs), cc, configs)
         if configs.debug:
-            # need to ssh to the host and run that command
-            print(configs.remote_host + ":", " ".join(commands))
-            p = subprocess.Popen(commands, stdout=sys.stdout, stderr=sys.stderr)
-        else:
-            p = subprocess.Popen(commands, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
+            print(name, " ".join(commands))
+        p = subprocess.Popen(commands, stderr=sys.stderr, stdout=sys.stdout)
+        tracing.process_started(p, f"{name} iperf3", commands)
         processes.append(p)
-    return processes
-
-
-def get_iperf3_client_cmd(target_ip, port, filename, cc, configs):
-    args = ["iperf3", "-c", f"{target_ip}", "-C", f"{cc}", f"-p {port}",
-            "-N", "-M", f"{PACKET_SIZE}",  "-i", "0", "-J", "-4", "--logfile", f"{filename}"]
-    if configs.total_size > 0:
-        args += ["-n", f"{configs.total_size}M"]
-    else:
-        args += ["-t", f"{configs.time}"]
-    # ignore the slow start, which is approximately 1s
-    args += ["-O", "1"]
-    if configs.remote_host == "localhost":
-        args += ["--window", "16M"]
-    return args
-
-
-def setup_client(node_from: mininet.node.Node, node_to: mininet.node.Node, configs, port, filename):
-    target_ip = node_to.IP()
-    # we output json file
-    # mtu 1500
-    # no delay
-    # window 16Mb
-    args = get_iperf3_client_cmd(target_ip, port, filename, configs.cc, configs)
-    cmd = " ".join(args)
-    if configs.debug:
-        print(f"setup_client: {node_from.name}: {cmd}")
-    node_from.cmd(cmd, shell=True, stderr=sys.stderr, stdout=sys.stdout)
-
-
-def setup_nodes(net: mininet.net.Mininet, configs):
-    # hardcode some stuff here
-    tcp_port1 = 9998
-    tcp_port2 = 9999 if configs.h2 else None
-    h1 = net.get("h1")
-    h3 = net.get("h3")
-    h1_result = get_filename(h1, configs)
-    h2_result = get_filename("h2", configs)
-    # need to remove this file if already exists
-    for filename in {h1_result, h2_result}:
-        if os.path.exists(filename):
-            os.remove(filename)
-    h3_proc = multiprocessing.Process(target=setup_mininet_iperf_server, args=(h3, tcp_port1, tcp_port2, configs))
-    h1_proc = multiprocessing.Process(target=setup_client, args=(h1, h3, configs, tcp_port1, h1_result))
-    if configs.h2:
-        h2 = net.get("h2")
-        h2_proc = multiprocessing.Process(target=setup_client,
-                                          args=(h2, h3, configs, tcp_port2, h2_result, configs.h2_cc))
-    else:
-        h2_proc = None
-
-    h3_proc.start()
-    time.sleep(2 if configs.h2 else 0.5)
-    h1_proc.start()
-    if configs.h2:
-        h2_proc.start()
-
-    processes = [h3_proc, h1_proc, h2_proc]
-    return processes
-
-
-def setup_lan(configs):
-    # we directly use iperf3 and tc, since mininet remote is not working properly
-    tcp_port1 = 9998
-    tcp_port2 = 9999 if configs.h2 else None
-    h1_result = get_filename("h1", configs)
-    h2_result = get_filename("h2", configs)
-    # need to remove this file if already exists
-    for filename in {h1_result, h2_result}:
-        if os.path.exists(filename):
-            os.remove(filename)
-    # the LAN subnet is 10.x.x.x
-    if configs.remote_host.split(".")[0] != "10":
-        assert os.path.exists(configs.remote_ssh_key)
-
-    h1_commands = get_iperf3_client_cmd(configs.remote_host, tcp_port1, h1_result, configs.cc, configs)
-    h2_commands = get_iperf3_client_cmd(configs.remote_host, tcp_port2, h2_result, configs.h2_cc, configs)
-
-    # start the server
-    processes = [setup_lan_iperf_server(tcp_port1, tcp_port2, configs)]
-
-    # set up tc command
-    # limit it to 1Gbps
-    tc_cmd = ["sudo", "tc", "qdisc", "add", "dev", "eth0", "root", "netem", "rate", "1Gbit"]
-    subprocess.check_call(tc_cmd)
-    # apply this to h2 as well, if enabled
-    if configs.h2:
-        tc_cmd = get_ssh_commands(configs.h2_host, tc_cmd, debug=configs.debug, id_file=configs.remote_ssh_key)
-        subprocess.check_call(tc_cmd)
-
-    tc_cmd = ["sudo", "tc", "qdisc", "add", "dev", configs.remote_eth, "root", "netem"]
-    # add delay
-    tc_cmd += ["delay", f"{configs.rtt / 2}ms"]
-    # add buffer size
-    tc_cmd += ["limit", f"{get_queue_size(configs.buffer_size)}"]
-    # bandwidth
-    tc_cmd += ["rate", f"{configs.bw}Mbit"]
-    if configs.loss > 0:
-        tc_cmd += ["loss", f"{int(configs.loss * 100)}%"]
-    # need to ssh into the
-    switch_tc_commands = get_ssh_commands(configs.switch, commands=tc_cmd, id_file=configs.remote_ssh_key)
-    if configs.debug:
-        print("switch:", " ".join(switch_tc_commands))
-    subprocess.check_call(switch_tc_commands)
-    # sleep a little bit to make sure the server is running
-    time.sleep(1)
-
-    # run the clients
-    if configs.debug:
-        print("h1", " ".join(h1_commands))
-    p = subprocess.Popen(h1_commands, stderr=sys.stderr, stdout=sys.stdout)
-    processes.append(p)
-    if tcp_port2 is not None:
-        if configs.debug:
-            print("h2", " ".join(h2_commands))
-        p = subprocess.Popen(h2_commands, stderr=sys.stderr, stdout=sys.stdout)
-        processes.append(p)
-    else:
+    if len(processes) == 1:
         processes.append(None)
-
     return processes
 
 
-def cleanup_mininet(net: mininet.net.Mininet, processes):
-    h3_proc, h1_proc, h2_proc = processes
-    for p in {h1_proc, h2_proc}:
-        if p is not None:
-            p.join()
-    h3_proc.kill()
-    h3 = net.get("h3")
-    # killall iperf3 instances
-    h3.cmd("killall iperf3")
-    mininet.clean.cleanup()
-
-
-def clear_lan_iperf3(configs):
-    cmd = "sudo tc qdisc del dev eth0 root netem"
-    subprocess.call(cmd.split(), stderr=subprocess.DEVNULL)
+def copy_to_lan_host(host, filename, remote_path, configs, port=22, username="mininet"):
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    commands = get_copy_commands(host, remote_path, configs, port, username)
+    with open(filename, "rb") as f, tracing.span(f"copy {os.path.basename(filename)} to {host}", "ssh"):
+        subprocess.check_call(commands, stdin=f)
+
+
+def start_lan_samplers(configs):
+    """Starts the samplers of the run. Returns them and the clock offset of the switch, if the queue is sampled"""
+    samplers = []
+    clock_offset = None
+    if configs.tcpinfo > 0:
+        # only h1 runs on this machine
+        commands = get_sampler_commands(configs.port, get_tcpinfo_filename(get_filename("h1", configs)),
+                                        configs.tcpinfo)
+        samplers.append(subprocess.Popen(commands))
+        tracing.process_started(samplers[-1], "tcpinfo sampler", commands)
+    if configs.queue > 0:
+        commands = get_switch_queue_sampler_commands(configs)
+        filename = qdisc.get_queue_filename(get_filename("h1", configs))
+        with open(filename, "wb") as f:
+            samplers.append(subprocess.Popen(commands, stdout=f))
+        tracing.process_started(samplers[-1], "queue sampler", commands)
+        clock_offset = wait_for_queue_sampler(filename, samplers[-1])
+    return samplers, clock_offset
+
+
+def call_agent(agent, *commands):
+    # one span per round trip
+    with tracing.span(f"{agent.name}: {', '.join(command['op'] for command in commands)}", "agent"):
+        return agent.call(*commands)
+
+
+def get_lan_agent(name, host, configs, port=22, username="mininet"):
+    if configs.agent_local:
+        # everything runs on this machine, which is enough to test the orchestration
+        return AgentClient(name, get_local_agent_commands(configs.agent_dry_run), configs.debug)
+    # copy the agent over every time so that all the machines run the same version. a daemon started by another
+    # version is restarted when it is connected to
+    copy_to_lan_host(host, "agent.py", REMOTE_AGENT_PATH, configs, port, username)
+    commands = get_ssh_commands(host, get_remote_agent_commands(REMOTE_AGENT_PATH, REMOTE_AGENT_SOCKET,
+                                                                configs.agent_dry_run),
+                                port, username=username, id_file=configs.remote_ssh_key)
+    return AgentClient(name, commands, configs.debug)
+
+
+def get_lan_agents(configs):
+    # h1 is this machine
+    agents = {"h1": AgentClient("h1", get_local_agent_commands(configs.agent_dry_run), configs.debug)}
     if configs.h2:
-        cmd = get_ssh_commands(configs.h2_host, commands=cmd.split(), id_file=configs.remote_ssh_key)
-        subprocess.call(cmd, stderr=subprocess.DEVNULL)
-    cmd = f"sudo tc qdisc del dev {configs.remote_eth} root netem"
-    switch_commands = get_ssh_commands(configs.switch, commands=cmd.split(), id_file=configs.remote_ssh_key)
-    subprocess.call(switch_commands, stderr=subprocess.DEVNULL)
+        agents["h2"] = get_lan_agent("h2", configs.h2_host, configs)
+    agents["switch"] = get_lan_agent("switch", configs.switch, configs)
+    agents["h3"] = get_lan_agent("h3", configs.remote_host, configs, port=configs.remote_host_port,
+                                 username=get_remote_username(configs.remote_host))
+    return agents
+
+
+def setup_lan_agents(agents, configs):
+    remove_lan_results(configs)
+    ports = get_lan_ports(configs)
+    # servers from the previous experiment are reused if they are still healthy
+    call_agent(agents["h3"], *[{"op": "iperf_start", "port": port} for port in ports])
+    # limit the senders to 1Gbps
+    for name in ["h1", "h2"]:
+        if name in agents:
+            call_agent(agents[name], {"op": "netem_apply", "dev": "eth0", "args": ["rate", "1Gbit"]})
+    call_agent(agents["switch"],
+               {"op": "netem_apply", "dev": configs.remote_eth, "args": get_lan_netem_args(configs)})
+    # instead of sleeping, wait until the servers accept connections
+    results = call_agent(agents["h3"], {"op": "ready", "ports": ports, "timeout": configs.ready_timeout})
+    latency = results[0]["latency"]
+    if configs.debug:
+        print(f"h3: servers ready after {latency:.3f}s")
+    return latency
 
 
-def cleanup_lan(processes, configs):
-    h3_processes, h1_proc, h2_proc = processes
-    for p in {h1_proc, h2_proc}:
-        if p is not None:
-            while True:
-                poll = p.poll()
-                if poll is None:
-                    time.sleep(0.1)
-                else:
-                    break
-    for p in h3_processes:
-        p.kill()
-    clear_lan_iperf3(configs)
+def clear_lan_agents(agents, configs):
+    # the iperf3 servers stay up for the next experiment
+    for name in ["h1", "h2"]:
+        if name in agents:
+            call_agent(agents[name], {"op": "netem_clear", "dev": "eth0"})
+    call_agent(agents["switch"], {"op": "netem_clear", "dev": configs.remote_eth})
 
 
-def check_output(configs):
-    # check if we generate the outputs properly
-    h1_result = get_filename("h1", configs)
-    h2_result = get_filename("h2", configs)
-    results = [h1_result]
-    if configs.h2:
-        results.append(h2_result)
-    for filename in results:
-        get_iperf_metrics(filename)
+def run_lan_agents(configs):
+    with timed_phase(configs, "setup"):
+        agents = get_lan_agents(configs)
+        if configs.queue > 0 and not configs.agent_local:
+            copy_to_lan_host(configs.switch, "qdisc.py", REMOTE_SAMPLER_PATH, configs)
+    processes = []
+    samplers = []
+    try:
+        with timed_phase(configs, "setup"):
+            latency = setup_lan_agents(agents, configs)
+            samplers, clock_offset = start_lan_samplers(configs)
+        with timed_phase(configs, "traffic"):
+            start_time = time.time()
+            record_run(configs, ready_latency=latency, start_time=start_time)
+            processes = start_lan_clients(configs)
+            for p in processes:
+                if p is not None:
+                    p.wait()
+                    tracing.process_finished(p)
+            end_time = time.time()
+    finally:
+        with timed_phase(configs, "teardown"):
+            for p in processes:
+                if p is not None and p.poll() is None:
+                    p.kill()
+            for p in samplers:
+                p.terminate()
+                p.wait()
+                tracing.process_finished(p)
+            clear_lan_agents(agents, configs)
+            for client in agents.values():
+                client.close()
+    if configs.queue > 0:
+        record_queue_summary(configs, qdisc.get_queue_filename(get_filename("h1", configs)), start_time, end_time,
+                             clock_offset)
 
 
 def run(configs):
@@ -304,39 +159,43 @@ def run(configs):
     if not os.path.exists(configs.output):
         os.makedirs(configs.output, exist_ok=True)
 
-    if configs.mininet_debug:
-        mininet.log.setLogLevel("debug")
-    if configs.remote_host != "localhost":
-        # use bare-metal iperf3 and tc
-        clear_lan_iperf3(configs)
-        processes = setup_lan(configs)
-        cleanup_lan(processes, configs)
-    else:
-        # clean up previous mininet runs in case of crashes
-        mininet.clean.cleanup()
-        topology = Topology(configs)
-        net = mininet.net.Mininet(topology, host=mininet.node.CPULimitedHost, link=mininet.link.TCLink)
-        net.start()
-
-        if configs.debug:
-            # test out the component
-            mininet.util.dumpNetConnections(net)
-            net.pingAll()
-
-        processes = setup_nodes(net, configs)
-        if configs.mininet_debug:
-            mininet.log.setLogLevel("error")
-
-        # clean up at the end
-        cleanup_mininet(net, processes)
-    # check if we got everything
-    check_output(configs)
+    # the cost model of the sweep learns from how long this takes
+    record_journal(configs, "running", duration=configs.time, total_size=configs.total_size)
+    configs.phases = {}
+    if configs.trace:
+        tracing.start()
+    try:
+        if configs.remote_host != "localhost" and configs.agent:
+            run_lan_agents(configs)
+        elif configs.remote_host != "localhost":
+            # use bare-metal iperf3 and tc
+            with timed_phase(configs, "import"):
+                import asyncio
+                from orchestrator import run_lan
+            asyncio.run(run_lan(configs))
+        else:
+            # mininet takes a while to import and LAN runs don't need it
+            with timed_phase(configs, "import"):
+                from emulation import run_mininet
+            run_mininet(configs)
+        # check if we got everything
+        with timed_phase(configs, "check"):
+            goodputs = check_output(configs)
+            if len(goodputs) > 1:
+                record_flow_summary(configs, goodputs)
+    except BaseException as ex:
+        # including Ctrl-C, so that the sweep knows this run didn't finish
+        record_journal(configs, "failed", error=repr(ex))
+        raise
+    finally:
+        # failed runs are traced as well
+        tracing.save(tracing.get_trace_filename(get_filename("h1", configs)))
+    record_journal(configs, "done", phases=configs.phases)
 
 
 def main():
     parser = argparse.ArgumentParser("BBR experiments")
-    ccs = get_available_cc()
-    parser.add_argument("-c", "--congestion-control", choices=ccs, default="bbr",
+    parser.add_argument("-c", "--congestion-control", default="bbr",
                         help="h1 congestion control algorithm type", type=str, dest="cc")
     parser.add_argument("--rtt", choices=[5, 10, 20, 25, 50, 75, 100, 150, 200], default=5,
                         help="RTT for the bottle net link", type=int, dest="rtt")
@@ -355,26 +214,86 @@ def main():
                         dest="time")
     parser.add_argument("--total-size", default=0, type=int, help="Total number of bytes to send (in MB). Cannot be "
                                                                   "used together with time", dest="total_size")
+    parser.add_argument("--adaptive", action="store_true", dest="adaptive",
+                        help="Stop the clients once throughput and retransmits are stable. -t becomes the maximum "
+                             "duration")
+    parser.add_argument("--adaptive-tolerance", default=0.05, type=float, dest="adaptive_tolerance",
+                        help="Maximum relative throughput variation for the run to be considered stable")
+    parser.add_argument("--adaptive-window", default=6, type=int, dest="adaptive_window",
+                        help="Number of interval reports used to test for a stable throughput")
+    parser.add_argument("--adaptive-interval", default=0.5, type=float, dest="adaptive_interval",
+                        help="iperf3 reporting interval in seconds when --adaptive is set")
     parser.add_argument("--debug", action="store_true", dest="debug")
     parser.add_argument("-o", "--output", type=str, dest="output", help="Output directory for the experiment",
                         default="out")
     parser.add_argument("-l", "--loss", type=float, default=0, dest="loss", help="Link loss rate")
+    parser.add_argument("-r", "--repetition", type=int, default=0, dest="repetition",
+                        help="Repetition of the same config. Results of repetitions after the first one are named "
+                             "with a -r<repetition> suffix")
     # whether to add h2
     parser.add_argument("--h2", action="store_true", dest="h2", help="Whether to use h2 in the experiment")
-    parser.add_argument("--h2-cc", default="bbr", choices=ccs,
+    parser.add_argument("--h2-cc", default="bbr",
                         help="h1 congestion control algorithm type", type=str, dest="h2_cc")
     parser.add_argument("--h2-host", default="localhost", dest="h2_host", help="h2 hostname", type=str)
+    parser.add_argument("--senders", default=None, type=int, dest="senders",
+                        help="Number of senders sharing the bottleneck, on consecutive ports. Replaces --h2. Only "
+                             "works with Mininet")
+    parser.add_argument("--sender-cc", default=None, nargs="+", type=str, dest="sender_cc",
+                        help="Congestion control of each sender. The last one is used for the remaining senders. "
+                             "Defaults to -c")
     parser.add_argument("--switch", default="localhost", dest="switch", help="Switch IP address. Only usefully for LAN"
                         " and WAN", type=str)
     parser.add_argument("--remote-ssh-key", default="", dest="remote_ssh_key", help="remote ssh identity key", type=str)
     parser.add_argument("--remote-eth", default="eth1", dest="remote_eth", help="Network interface to the remote host",
                         type=str)
+    parser.add_argument("--agent", action="store_true", dest="agent",
+                        help="Control the LAN machines through agent.py, which keeps the iperf3 servers running "
+                             "between experiments")
+    parser.add_argument("--agent-local", action="store_true", dest="agent_local",
+                        help="Run the agents of the remote machines on this machine, e.g. to test the orchestration")
+    parser.add_argument("--agent-dry-run", action="store_true", dest="agent_dry_run",
+                        help="Agents only report the tc commands instead of running them")
+    parser.add_argument("--ready-timeout", default=10, type=float, dest="ready_timeout",
+                        help="Seconds to wait for the iperf3 servers to accept connections")
+    parser.add_argument("--tcpinfo", default=0, type=float, dest="tcpinfo",
+                        help="Sample TCP_INFO of the sender flows every given number of ms into a .tcpinfo file next "
+                             "to the result. 0 disables sampling")
+    parser.add_argument("--queue", default=0, type=float, dest="queue",
+                        help="Sample the bottleneck queue every given number of ms into a .qdisc file next to the "
+                             "result. 0 disables sampling")
+    parser.add_argument("--trace", action="store_true", dest="trace",
+                        help="Trace the phases, subprocesses and ssh calls into a Chrome trace .trace file next to "
+                             "the result")
     # for mininet debug
     parser.add_argument("--mininet-debug", action="store_true", dest="mininet_debug")
+    # for parallel sweeps
+    parser.add_argument("--job-id", default=None, type=int, dest="job_id",
+                        help="Job slot when running in parallel with other experiments. Used to scope node names, "
+                             "subnets and cleanup")
+    parser.add_argument("--port", default=DEFAULT_PORT, type=int, dest="port",
+                        help="iperf3 server port for h1. The other senders use the next ports")
+    parser.add_argument("--session", action="store_true", dest="session",
+                        help="Keep the Mininet topology alive and run one experiment per JSON line read from stdin, "
+                             "e.g. {\"rtt\": 10, \"bw\": 100, \"buffer_size\": 0.1, \"loss\": 0}")
     args = parser.parse_args()
+    check_available_cc(parser, [args.cc, args.h2_cc] + (args.sender_cc or []))
+    if args.adaptive:
+        check_json_stream(parser)
+    if args.senders is not None:
+        assert 0 < args.senders <= MAX_SENDERS, f"--senders must be between 1 and {MAX_SENDERS}"
+        assert not args.h2, "--h2 cannot be used together with --senders"
+        assert args.remote_host == "localhost", "--senders only works with Mininet"
+
+    # e.g. a sweep worker whose lease was lost stops the run with SIGTERM, through sudo. raising unwinds the run the
+    # same way as Ctrl-C, so that the network and the servers are cleaned up
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
 
     # run the experiments
-    run(args)
+    if args.session:
+        from emulation import run_session
+        run_session(args)
+    else:
+        run(args)
 
 
 if __name__ == "__main__":
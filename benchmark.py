@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# measures how much of the wall time of a sweep goes to the traffic and how much to the orchestration around it.
+# short experiments are run through each entry point, and the time of every phase is taken from the journal of
+# the output folder. the numbers are saved as JSON, so that they can be compared between versions
+# usage: sudo benchmark.py [-s <scenario> ...] [-n <experiments>] [-t <duration>] [-o <json>] [--compare <json>]
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from util import get_journal_records
+
+# the phases recorded by experiment.timed_phase, in order. process is the rest of the wall time: starting the
+# Python processes, importing, argument parsing and the journal
+phase_names = ["process", "import", "cleanup", "setup", "traffic", "teardown", "check"]
+# persistent is run --persistent, and lan is bbr.py against agents on this machine
+scenarios = ["mininet", "run", "persistent", "lan"]
+
+
+def get_scenario_commands(scenario, output, configs):
+    """Commands that run configs.num experiments of the scenario into output. Each is timed on its own"""
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    bbr = [sys.executable, os.path.join(dirname, "bbr.py"), "-c", configs.cc, "-t", str(configs.time),
+           "-o", output]
+    run = [sys.executable, os.path.join(dirname, "run"), "mininet", "-c", configs.cc, "-t", str(configs.time),
+           "--rtt-range", "5", "--bw-range", "10", "--size-range", "0.1", "--loss-range", "0",
+           "-r", str(configs.num), "-o", output]
+    if scenario == "mininet":
+        # a single experiment per bbr.py process
+        return [bbr + ["-r", str(i)] for i in range(configs.num)]
+    if scenario == "run":
+        # one bbr.py process per experiment, spawned by run
+        return [run]
+    if scenario == "persistent":
+        # one topology for the whole sweep
+        return [run + ["--persistent"]]
+    assert scenario == "lan"
+    # the agents of the remote machines run on this machine and only report the tc commands
+    lan = ["--remote-host", "127.0.0.1", "--agent", "--agent-local", "--agent-dry-run"]
+    return [bbr + lan + ["-r", str(i)] for i in range(configs.num)]
+
+
+def run_scenario(scenario, output, configs):
+    os.makedirs(output)
+    wall = 0
+    for commands in get_scenario_commands(scenario, output, configs):
+        if configs.debug:
+            print(*commands)
+        start = time.time()
+        subprocess.run(commands, check=True, stdout=None if configs.debug else subprocess.DEVNULL)
+        wall += time.time() - start
+    done = [record for record in get_journal_records(output) if record["state"] == "done"]
+    assert len(done) == configs.num, f"{scenario}: {len(done)} of {configs.num} experiments finished"
+    phases = {name: 0 for name in phase_names}
+    for record in done:
+        for name, seconds in record.get("phases", {}).items():
+            phases[name] = phases.get(name, 0) + seconds
+    phases["process"] = wall - sum(phases.values())
+    traffic = phases["traffic"]
+    return {"experiments": len(done), "wall": wall, "experiments_per_hour": len(done) * 3600 / wall,
+            "traffic_share": traffic / wall, "overhead_per_experiment": (wall - traffic) / len(done),
+            "phases": {name: seconds / len(done) for name, seconds in phases.items()}}
+
+
+def get_version():
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=dirname,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(scenario, result):
+    print(f"{scenario}: {result['experiments']} experiments in {result['wall']:.1f}s, "
+          f"{result['experiments_per_hour']:.0f} experiments/h, {result['traffic_share'] * 100:.0f}% traffic, "
+          f"{result['overhead_per_experiment']:.2f}s overhead per experiment")
+    for name, seconds in result["phases"].items():
+        print(f"  {name:<10} {seconds:8.3f}s")
+
+
+def print_comparison(baseline, benchmark):
+    print(f"Compared to {baseline.get('version')}:")
+    for scenario, result in benchmark["scenarios"].items():
+        if scenario not in baseline["scenarios"]:
+            continue
+        old = baseline["scenarios"][scenario]
+        change = result["experiments_per_hour"] / old["experiments_per_hour"] - 1
+        print(f"{scenario}: {old['experiments_per_hour']:.0f} -> {result['experiments_per_hour']:.0f} "
+              f"experiments/h ({change * 100:+.1f}%)")
+        for name, seconds in result["phases"].items():
+            print(f"  {name:<10} {seconds - old['phases'].get(name, 0):+8.3f}s")
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Benchmark the orchestration overhead of the experiments")
+    parser.add_argument("-s", "--scenarios", nargs="+", choices=scenarios, default=scenarios, dest="scenarios",
+                        help="Entry points to benchmark")
+    parser.add_argument("-n", "--num", default=3, type=int, dest="num", help="Experiments per scenario")
+    parser.add_argument("-t", "--time", default=1, type=int, dest="time", help="Duration of every experiment")
+    parser.add_argument("-c", "--congestion-control", default="cubic", type=str, dest="cc",
+                        help="Congestion control of the experiments")
+    parser.add_argument("-o", "--output", default="benchmark.json", type=str, dest="output",
+                        help="JSON file to save the numbers to")
+    parser.add_argument("--compare", default="", type=str, dest="compare",
+                        help="JSON file of an earlier benchmark to compare against")
+    parser.add_argument("--keep", action="store_true", dest="keep", help="Keep the results of the experiments")
+    parser.add_argument("--debug", action="store_true", dest="debug")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    assert os.geteuid() == 0, f"{sys.argv[0]} has to be run with sudo"
+    root = tempfile.mkdtemp(prefix="bbr_benchmark_")
+    benchmark = {"version": get_version(), "time": time.time(), "host": platform.node(),
+                 "num": args.num, "duration": args.time, "cc": args.cc, "scenarios": {}}
+    try:
+        for scenario in args.scenarios:
+            result = run_scenario(scenario, os.path.join(root, scenario), args)
+            benchmark["scenarios"][scenario] = result
+            print_result(scenario, result)
+    finally:
+        if args.keep:
+            print("Results are in", root)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    with open(args.output, "w+") as f:
+        json.dump(benchmark, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), benchmark)
+
+
+if __name__ == "__main__":
+    main()
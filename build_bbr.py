@@ -1,43 +1,204 @@
 import argparse
-import urllib.request
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import re
 import tempfile
 import os
+import shutil
 import subprocess
 
+SOURCE_COMMIT = "9d31d2338950293ec19d9b095fbaa9030899dcb4"
+SOURCE_URL = f"https://github.com/torvalds/linux/raw/{SOURCE_COMMIT}/net/ipv4/tcp_bbr.c"
+
+# the constants of tcp_bbr.c a variant can change, with their upstream values. gains are fractions a / b of BBR_UNIT.
+# up_gain and down_gain are the pacing gains of the cycle phases that probe for bandwidth and drain the queue again
+bbr_params = {"up_gain": (5, 4), "down_gain": (3, 4), "cwnd_gain": (2, 1), "min_rtt_win_sec": 10,
+              "probe_rtt_mode_ms": 200}
+gain_params = {"up_gain", "down_gain", "cwnd_gain"}
+# the line of every constant in the source, and what it is replaced with. up_gain and the name are always replaced
+param_patterns = {
+    "up_gain": (r"^.*BBR_UNIT\s*\*\s*5\s*/\s*4\s*,.*$", "BBR_UNIT * {0} / {1},"),
+    "down_gain": (r"^.*BBR_UNIT\s*\*\s*3\s*/\s*4\s*,.*$", "\tBBR_UNIT * {0} / {1},"),
+    "cwnd_gain": (r"(bbr_cwnd_gain\s*=\s*)BBR_UNIT\s*\*\s*2\s*;", "\\g<1>BBR_UNIT * {0} / {1};"),
+    "min_rtt_win_sec": (r"(bbr_min_rtt_win_sec\s*=\s*)10\s*;", "\\g<1>{0};"),
+    "probe_rtt_mode_ms": (r"(bbr_probe_rtt_mode_ms\s*=\s*)200\s*;", "\\g<1>{0};"),
+}
+NAME_PATTERN = (r'^.*\.name\s*=\s*"bbr"\s*,.*$', '.name\t\t= "{0}",')
+# the kernel's TCP_CA_NAME_MAX, including the terminating 0
+MAX_NAME_LENGTH = 16
+
 
 def get_args():
-    parser = argparse.ArgumentParser("Build BBR with different gain value")
-    parser.add_argument("-o", "--output", help="Working directory. If not set, a temp dir is used", default="",
+    parser = argparse.ArgumentParser("Build BBR with different gain values and constants")
+    parser.add_argument("-o", "--output", help="Working directory. If not set, a temp dir is used. With more than "
+                                               "one variant, every variant is built in a subdirectory", default="",
                         type=str)
     parser.add_argument("--install", action="store_true", help="When set, install to the kernel as well")
     parser.add_argument("--uninstall", action="store_true", help="When set, uninstall the kernel module")
-    parser.add_argument("-g", "--gain", nargs=2, help="BBR gain value in the form of a / b", type=int, required=True)
-    return parser.parse_args()
+    parser.add_argument("-g", "--gain", nargs=2, action="append", type=int, default=[],
+                        help="BBR gain value in the form of a / b. Can be given more than once")
+    parser.add_argument("--grid", nargs="+", default=[], type=str, dest="grid",
+                        help="Build every combination of the given values of BBR constants, e.g. up_gain=5/4,3/2 "
+                             f"cwnd_gain=2,5/2. Constants: {', '.join(bbr_params)}")
+    parser.add_argument("-j", "--jobs", default=os.cpu_count(), type=int, dest="jobs",
+                        help="Number of variants to build at the same time")
+    parser.add_argument("--cache", default=get_cache_dir(), type=str, dest="cache",
+                        help="Cache of the source and the built modules")
+    parser.add_argument("--source", default="", type=str, dest="source",
+                        help=f"Local copy of tcp_bbr.c at {SOURCE_COMMIT}, used instead of downloading it, e.g. on "
+                             f"machines without network access. It has to match the cached copy if there is one")
+    parser.add_argument("--no-cache", action="store_true", dest="no_cache",
+                        help="Build the modules even if they are in the cache")
+    parser.add_argument("--patch-only", action="store_true", dest="patch_only",
+                        help="Only write the patched sources and Makefiles to -o, without building them")
+    args = parser.parse_args()
+    if not args.gain and not args.grid:
+        parser.error("either -g or --grid is required")
+    if args.patch_only:
+        assert args.output, "--patch-only requires -o"
+        assert not args.install and not args.uninstall, "--patch-only cannot be used together with --install"
+    return args
+
+
+def get_cache_dir():
+    dirname = os.environ.get("BBR_BUILD_CACHE", "")
+    if dirname:
+        return dirname
+    cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_dir, "when-to-use-bbr", "build")
+
+
+def write_atomic(filename, data):
+    # parallel builds share the cache, so files only show up once they are complete
+    with open(filename + f".{os.getpid()}.part", "wb") as f:
+        f.write(data)
+    os.replace(filename + f".{os.getpid()}.part", filename)
+
+
+def get_source(cache_dir, source=""):
+    """The pinned tcp_bbr.c, downloaded once into the cache, or the local copy in source"""
+    filename = os.path.join(cache_dir, "source", f"tcp_bbr-{SOURCE_COMMIT}.c")
+    cached = None
+    if os.path.exists(filename):
+        with open(filename, "rb") as f:
+            cached = f.read()
+    if source:
+        # a local copy is never cached under the name of the pinned commit, it could be any version of the file.
+        # once the pinned copy is cached, a local copy has to be the same file
+        with open(source, "rb") as f:
+            data = f.read()
+        if cached is not None and data != cached:
+            raise RuntimeError(f"{source} (sha256 {hashlib.sha256(data).hexdigest()}) differs from tcp_bbr.c at "
+                               f"{SOURCE_COMMIT} in {filename} (sha256 {hashlib.sha256(cached).hexdigest()})")
+        return data.decode("utf-8")
+    if cached is not None:
+        return cached.decode("utf-8")
+    # only needed the first time, without it build_bbr stays quick to import for run
+    import urllib.error
+    import urllib.request
+    try:
+        with urllib.request.urlopen(SOURCE_URL) as f:
+            data = f.read()
+    except urllib.error.URLError as ex:
+        raise RuntimeError(f"Unable to download {SOURCE_URL}: {ex}. Copy the file over and pass it with "
+                           f"--source")
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    write_atomic(filename, data)
+    return data.decode("utf-8")
+
+
+def parse_param_value(name, value):
+    assert name in bbr_params, f"Unknown BBR constant {name}, choose from {', '.join(bbr_params)}"
+    if name in gain_params:
+        a, _, b = value.partition("/")
+        return int(a), int(b or 1)
+    return int(value)
+
+
+def format_params(params):
+    return " ".join(f"{name}={'/'.join(map(str, value)) if name in gain_params else value}"
+                    for name, value in params.items())
+
+
+def get_variant_grid(specs):
+    """Every combination of the values of specs, e.g. ["up_gain=5/4,3/2", "cwnd_gain=2"], as dicts of the
+    constants that differ from upstream"""
+    names = []
+    values = []
+    for spec in specs:
+        name, _, text = spec.partition("=")
+        names.append(name)
+        values.append([parse_param_value(name, value) for value in text.split(",")])
+    return [get_variant_params(dict(zip(names, combination))) for combination in itertools.product(*values)]
+
+
+def get_variant_params(params):
+    # in the order of bbr_params, so that the same variant always gets the same name
+    return {name: tuple(params[name]) if name in gain_params else params[name]
+            for name in bbr_params if name in params and params[name] != bbr_params[name]}
+
+
+def get_variant_name(params):
+    # variants that only change the pacing gain keep the names they had before the other constants, e.g. bbr_3_2
+    if set(params) <= {"up_gain"}:
+        a, b = params.get("up_gain", bbr_params["up_gain"])
+        name = f"bbr_{a}_{b}"
+    else:
+        name = "bbr_" + hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+    assert len(name) < MAX_NAME_LENGTH, f"{name} is too long for a congestion control name"
+    return name
+
+
+def patch_source(code, name, pattern, replacement):
+    # a pattern that doesn't match exactly once would build upstream BBR, or break it, under the name of the variant
+    code, count = re.subn(pattern, replacement, code, flags=re.MULTILINE)
+    if count != 1:
+        raise RuntimeError(f"Unable to find {name} in tcp_bbr.c at {SOURCE_COMMIT}, found it {count} times")
+    return code
 
 
-def build_install(gain: float, cwd: str, install: bool, uninstall: bool):
+def get_variant_source(source, params):
+    code = patch_source(source, "the name", NAME_PATTERN[0], NAME_PATTERN[1].format(get_variant_name(params)))
+    # up_gain is replaced even if it doesn't change, the other constants only if they do. this keeps the source of
+    # gain-only variants as it was before the other constants
+    params = {"up_gain": bbr_params["up_gain"], **params}
+    for name, value in params.items():
+        pattern, replacement = param_patterns[name]
+        values = value if name in gain_params else (value,)
+        code = patch_source(code, name, pattern, replacement.format(*values))
+    return code
+
+
+def get_makefile(suffix):
+    return (f"obj-m += tcp_{suffix}.o\n"
+            "KDIR=/lib/modules/`uname -r`/build\n"
+            "default:\n"
+            "\t$(MAKE) -C $(KDIR) M=$(shell pwd)\n")
+
+
+def get_cached_module_filename(cache_dir, code, makefile, suffix):
+    # the module only depends on its source, the Makefile and the kernel it is built against
+    key = hashlib.sha256((code + makefile).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "modules", os.uname().release, key, f"tcp_{suffix}.ko")
+
+
+def build(params, cwd: str, cache_dir: str, source: str, use_cache=True, patch_only=False):
+    """Builds the variant in cwd, unless it is in the cache already. Returns the module in the cache, or the patched
+    source in cwd with patch_only"""
+    suffix = get_variant_name(params)
+    code = get_variant_source(source, params)
+    makefile = get_makefile(suffix)
+    cached = get_cached_module_filename(cache_dir, code, makefile, suffix)
     if not os.path.exists(cwd):
         os.makedirs(cwd, exist_ok=True)
-    # download the file
-    url = "https://github.com/torvalds/linux/raw/9d31d2338950293ec19d9b095fbaa9030899dcb4/net/ipv4/tcp_bbr.c"
-    with urllib.request.urlopen(url) as f:
-        html = f.read().decode('utf-8')
-    # replace the lines based on gain
-    lines = html.split("\n")
-
-    # compute ratio
-    a, b = gain
-    suffix = f"bbr_{a}_{b}"
-
-    for i in range(len(lines)):
-        line = lines[i]
-        if "BBR_UNIT * 5 / 4," in line:
-            lines[i] = f"BBR_UNIT * {a} / {b},"
-        if ".name		= \"bbr\"," in line:
-            # replace it with a new name
-            lines[i] = f".name		= \"{suffix}\","
-
-    code = "\n".join(lines)
+    if use_cache and not patch_only and os.path.exists(cached):
+        print("Using cached", cached)
+        # the working directory still gets the module, like after a build
+        shutil.copyfile(cached, os.path.join(cwd, f"tcp_{suffix}.ko"))
+        return cached
+
     filename = os.path.join(cwd, f"tcp_{suffix}.c")
     with open(filename, "w+") as f:
         f.write(code)
@@ -45,31 +206,90 @@ def build_install(gain: float, cwd: str, install: bool, uninstall: bool):
     # also write the make file
     make = os.path.join(cwd, "Makefile")
     with open(make, "w+") as f:
-        f.write(f"obj-m += tcp_{suffix}.o\n")
-        f.write("KDIR=/lib/modules/`uname -r`/build\n")
-        f.write("default:\n")
-        f.write("\t$(MAKE) -C $(KDIR) M=$(shell pwd)\n")
+        f.write(makefile)
+    if patch_only:
+        return filename
 
     # build it
     subprocess.check_call("make", cwd=cwd, shell=True)
     filename = os.path.join(cwd, f"tcp_{suffix}.ko")
-    filename = os.path.abspath(filename)
-    if install:
-        # install it
-        print("Installing", filename)
-        subprocess.check_call(["insmod", filename])
-    if uninstall:
-        print("Uninstalling", filename)
-        subprocess.check_call(["rmmod", filename])
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    with open(filename, "rb") as f:
+        write_atomic(cached, f.read())
+    return cached
+
+
+def is_installed(name):
+    return os.path.exists(os.path.join("/sys/module", f"tcp_{name}"))
+
+
+def install(filename, name):
+    """Loads the module unless it is loaded already. Returns whether it was loaded"""
+    # re-provisioning a machine shouldn't fail on the modules that are already loaded
+    if is_installed(name):
+        print(f"tcp_{name} is already installed")
+        return False
+    print("Installing", filename)
+    subprocess.check_call(["insmod", filename])
+    return True
+
+
+def uninstall(name):
+    print("Uninstalling", f"tcp_{name}")
+    subprocess.check_call(["rmmod", f"tcp_{name}"])
+
+
+def build_install(gain, cwd: str, install_module: bool, uninstall_module: bool, cache_dir=None, source="",
+                  use_cache=True):
+    cache_dir = cache_dir or get_cache_dir()
+    params = get_variant_params({"up_gain": gain})
+    filename = build(params, cwd, cache_dir, get_source(cache_dir, source), use_cache)
+    if install_module:
+        install(filename, get_variant_name(params))
+    if uninstall_module:
+        uninstall(get_variant_name(params))
+
+
+def build_variants(variants, cwd, cache_dir=None, source="", jobs=os.cpu_count(), use_cache=True, patch_only=False):
+    """Builds the variants, dicts of BBR constants, in parallel. Each variant is built in its own subdirectory of
+    cwd, or in cwd itself if there is only one. Returns the modules in the cache, or the patched sources with
+    patch_only"""
+    cache_dir = cache_dir or get_cache_dir()
+    # the source is fetched once before the builds start
+    source = get_source(cache_dir, source)
+    if len(variants) == 1:
+        cwds = [cwd]
+    else:
+        cwds = [os.path.join(cwd, get_variant_name(params)) for params in variants]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        # make runs in its own process, so threads are enough
+        futures = [pool.submit(build, params, variant_cwd, cache_dir, source, use_cache, patch_only)
+                   for params, variant_cwd in zip(variants, cwds)]
+        return [future.result() for future in futures]
+
+
+def build_all(configs, cwd):
+    variants = [get_variant_params({"up_gain": gain}) for gain in configs.gain] + get_variant_grid(configs.grid)
+    # the same variant may be asked for twice, e.g. -g 5 4 and the upstream value of a grid
+    variants = list({get_variant_name(params): params for params in variants}.values())
+    filenames = build_variants(variants, cwd, configs.cache, configs.source, configs.jobs, not configs.no_cache,
+                               configs.patch_only)
+    for params, filename in zip(variants, filenames):
+        name = get_variant_name(params)
+        print(f"{name}: {format_params(params) or 'upstream'}")
+        if configs.install:
+            install(filename, name)
+        if configs.uninstall:
+            uninstall(name)
 
 
 def main():
     configs = get_args()
     if configs.output:
-        build_install(configs.gain, configs.output, configs.install, configs.uninstall)
+        build_all(configs, configs.output)
     else:
         with tempfile.TemporaryDirectory() as temp:
-            build_install(configs.gain, temp, configs.install, configs.uninstall)
+            build_all(configs, temp)
 
 
 if __name__ == "__main__":
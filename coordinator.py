@@ -0,0 +1,220 @@
+# distributes the experiments of a sweep across emulation hosts. every host runs worker.py, over ssh or as a local
+# process, and runs one experiment at a time. an experiment is leased to a worker and the lease is renewed by the
+# worker's heartbeats. leases that are lost, e.g. because the host or the connection died, go back to the queue and
+# the result files of finished experiments are collected into one output folder
+
+import asyncio
+import base64
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+
+import tracing
+from experiment import get_copy_commands
+from sshpool import get_ssh_commands, get_remote_username, REMOTE_WORKER_PATH
+from worker import STOP_TIMEOUT as WORKER_STOP_TIMEOUT
+from util import append_journal
+
+# the result files can be megabytes, and they are all sent on a single line
+LINE_LIMIT = 1 << 30
+# a worker that loses this many leases in a row is given up on
+MAX_LOST_LEASES = 3
+
+# an experiment of the sweep. get_commands(output, worker) returns the command that writes its results to output
+Task = collections.namedtuple("Task", ["name", "get_commands"])
+
+
+class LeaseLost(RuntimeError):
+    pass
+
+
+class WorkerConnection:
+    """A worker.py process on a host. host is "local" for a process on this machine. Workers that share a host get
+    different slots, which bbr.py uses to keep parallel experiments apart"""
+    def __init__(self, host, slot, num_slots, configs):
+        self.host = host
+        self.slot = slot
+        self.num_slots = num_slots
+        self.name = host if num_slots == 1 else f"{host}#{slot}"
+        self.__configs = configs
+        self.__p = None
+        self.__next_lease = 0
+
+    def is_local(self):
+        return self.host == "local"
+
+    def get_commands(self):
+        if self.is_local():
+            return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")]
+        return get_ssh_commands(self.host, ["python3", REMOTE_WORKER_PATH], username=get_remote_username(self.host),
+                                id_file=self.__configs.remote_ssh_key)
+
+    async def start(self):
+        if self.__p is not None and self.__p.returncode is None:
+            return
+        if not self.is_local():
+            # copy the worker over every time so that all the hosts run the same version
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py"), "rb") as f:
+                commands = get_copy_commands(self.host, REMOTE_WORKER_PATH, self.__configs,
+                                             username=get_remote_username(self.host))
+                p = await asyncio.create_subprocess_exec(*commands, stdin=f)
+                if await p.wait() != 0:
+                    raise LeaseLost(f"Unable to copy the worker to {self.host}")
+        commands = self.get_commands()
+        if self.__configs.debug:
+            print(f"{self.name}:", " ".join(commands))
+        self.__p = await asyncio.create_subprocess_exec(*commands, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                        limit=LINE_LIMIT)
+
+    async def stop(self):
+        if self.__p is None:
+            return
+        if self.__p.returncode is None:
+            # closing stdin tells the worker to stop its experiment
+            self.__p.stdin.close()
+            try:
+                # the worker gives its experiment WORKER_STOP_TIMEOUT to clean up
+                await asyncio.wait_for(self.__p.wait(), timeout=WORKER_STOP_TIMEOUT + 10)
+            except asyncio.TimeoutError:
+                self.__p.kill()
+                await self.__p.wait()
+        self.__p = None
+
+    async def run(self, task, lease_timeout):
+        """Runs the task and returns the done message of the worker. Raises LeaseLost if the worker doesn't renew
+        the lease in time"""
+        self.__next_lease += 1
+        lease = self.__next_lease
+        output = f"/tmp/bbr_lease_{os.getpid()}_{self.slot}_{lease}"
+        request = {"lease": lease, "commands": task.get_commands(output, self), "output": output,
+                   "heartbeat": lease_timeout / 3}
+        if self.__configs.debug:
+            print(f"{self.name} <", json.dumps(request))
+        try:
+            self.__p.stdin.write((json.dumps(request) + "\n").encode())
+            await self.__p.stdin.drain()
+        except ConnectionError as ex:
+            raise LeaseLost(f"{self.name} is gone: {ex}")
+        while True:
+            try:
+                line = await asyncio.wait_for(self.__p.stdout.readline(), timeout=lease_timeout)
+            except asyncio.TimeoutError:
+                raise LeaseLost(f"{self.name} missed its heartbeats for {lease_timeout}s")
+            if not line:
+                raise LeaseLost(f"{self.name} exited")
+            message = json.loads(line)
+            if message["lease"] != lease:
+                continue
+            if message["event"] == "done":
+                return message
+
+
+def collect_files(output, files):
+    # the sampler files first and the results last, each moved into place once it is complete, so that a result
+    # never shows up without its samples
+    names = sorted(files, key=lambda n: n.endswith(".json"))
+    for name in names:
+        data = base64.b64decode(files[name])
+        if name == "journal.jsonl":
+            # the coordinator keeps the journal of the sweep
+            continue
+        if name == "runs.jsonl":
+            with open(os.path.join(output, name), "ab") as f:
+                f.write(data)
+            continue
+        filename = os.path.join(output, name)
+        with open(filename + ".part", "wb") as f:
+            f.write(data)
+        os.replace(filename + ".part", filename)
+
+
+async def run_worker(worker, queue, configs, failed, progress):
+    lost = 0
+    while True:
+        task, attempt = await queue.get()
+        span_id = None
+        try:
+            await worker.start()
+            append_journal(configs.out, task.name, "running", worker=worker.name, attempt=attempt,
+                           duration=configs.time, total_size=configs.total_size)
+            span_id = tracing.begin(task.name, "lease", worker=worker.name, attempt=attempt)
+            message = await worker.run(task, configs.lease_timeout)
+            tracing.end(span_id, returncode=message["returncode"])
+        except Exception as ex:
+            if not isinstance(ex, LeaseLost):
+                # e.g. ssh can't reach the host or the pipe to a local worker broke. the task isn't lost with it
+                ex = LeaseLost(f"{worker.name} failed: {ex!r}")
+            tracing.end(span_id, error=str(ex))
+            await worker.stop()
+            lost += 1
+            if attempt < configs.lease_retries:
+                print(f"{task.name}: {ex}, retrying", file=sys.stderr)
+                append_journal(configs.out, task.name, "planned", error=str(ex))
+                queue.put_nowait((task, attempt + 1))
+            else:
+                append_journal(configs.out, task.name, "failed", error=str(ex))
+                failed.append(task.name)
+                progress.finish(task.name)
+            if lost >= MAX_LOST_LEASES:
+                print(f"{worker.name}: lost {lost} leases in a row, giving up on it", file=sys.stderr)
+                return
+            continue
+        finally:
+            queue.task_done()
+        lost = 0
+        if message["returncode"] == 0:
+            collect_files(configs.out, message["files"])
+            append_journal(configs.out, task.name, "done", worker=worker.name)
+        else:
+            # the experiment itself failed. running it again elsewhere wouldn't help
+            append_journal(configs.out, task.name, "failed", worker=worker.name,
+                           error=f"exited with {message['returncode']}")
+            failed.append(task.name)
+        progress.finish(task.name)
+
+
+def get_workers(hosts, configs):
+    # a host that is listed more than once runs that many experiments at the same time
+    counts = collections.Counter(hosts)
+    slots = collections.Counter()
+    workers = []
+    for host in hosts:
+        workers.append(WorkerConnection(host, slots[host], counts[host], configs))
+        slots[host] += 1
+    return workers
+
+
+async def run_coordinator(tasks, configs, progress):
+    """Runs the tasks on configs.workers, in order, and collects the results into configs.out. progress is told
+    about every finished task. Raises RuntimeError if an experiment failed or all the workers are gone"""
+    start = time.time()
+    queue = asyncio.Queue()
+    for task in tasks:
+        queue.put_nowait((task, 0))
+    workers = get_workers(configs.workers, configs)
+    failed = []
+    worker_tasks = [asyncio.ensure_future(run_worker(worker, queue, configs, failed, progress)) for worker in workers]
+    join = asyncio.ensure_future(queue.join())
+    try:
+        # the workers only return if they are given up on
+        await asyncio.wait([join] + worker_tasks, return_when=asyncio.FIRST_COMPLETED)
+        while not join.done():
+            if all(t.done() for t in worker_tasks):
+                raise RuntimeError(f"All workers are gone, {queue.qsize()} experiments left")
+            await asyncio.wait([join] + [t for t in worker_tasks if not t.done()],
+                               return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        join.cancel()
+        for t in worker_tasks:
+            t.cancel()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+        await asyncio.gather(*[worker.stop() for worker in workers])
+    for t in worker_tasks:
+        if not t.cancelled() and t.exception() is not None:
+            raise t.exception()
+    print(f"Ran {len(tasks)} experiments on {len(workers)} workers in {time.time() - start:.0f}s")
+    if failed:
+        raise RuntimeError(f"{len(failed)} experiments failed: {', '.join(failed)}. See journal.jsonl")
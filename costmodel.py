@@ -0,0 +1,104 @@
+# predicts how long an experiment takes, so that sweeps can show an ETA and start the longest experiments first.
+# an experiment takes a fixed overhead to set up and tear down the network, plus the transfer: the test duration
+# in time mode, or the total size at the bottleneck bandwidth in total size mode. the overhead and the scale of the
+# transfer time are calibrated from the durations of past runs in journal.jsonl
+
+import datetime
+import threading
+import time
+
+from util import get_journal_records, parse_name_config
+
+# building the topology, starting the servers and cleaning up, in seconds
+DEFAULT_OVERHEAD = 10
+# a total size transfer also needs a few round trips to get up to speed
+SLOW_START_RTTS = 10
+
+
+def get_transfer_time(rtt, bw, duration, total_size):
+    if total_size > 0:
+        # MB at Mbps
+        return total_size * 8 / bw + SLOW_START_RTTS * rtt / 1000
+    return duration
+
+
+def get_journal_samples(dirname):
+    """(transfer time, measured wall time) of every run in the journal that went from running to done"""
+    samples = []
+    running = {}
+    for record in get_journal_records(dirname):
+        if record["state"] == "running":
+            running[record["name"]] = record
+        elif record["state"] == "done" and record["name"] in running:
+            start = running.pop(record["name"])
+            # journals from before the cost model don't have the mode
+            if "duration" not in start:
+                continue
+            config = parse_name_config(record["name"])
+            transfer_time = get_transfer_time(config.rtt, config.bw, start["duration"], start["total_size"])
+            samples.append((transfer_time, record["time"] - start["time"]))
+    return samples
+
+
+class CostModel:
+    def __init__(self, overhead=DEFAULT_OVERHEAD, scale=1.0):
+        self.overhead = overhead
+        self.scale = scale
+
+    def predict(self, rtt, bw, duration, total_size):
+        return self.overhead + self.scale * get_transfer_time(rtt, bw, duration, total_size)
+
+    def calibrate(self, samples):
+        """Fits the overhead and the scale to (transfer time, measured wall time) samples with least squares"""
+        if len(samples) == 0:
+            return
+        n = len(samples)
+        mean_x = sum(x for x, _ in samples) / n
+        mean_y = sum(y for _, y in samples) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+        if var_x > 0:
+            scale = sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x
+            # noise can make the fit meaningless, e.g. with only a few runs of similar length
+            if scale > 0:
+                self.scale = scale
+        # with a single transfer time, e.g. a time mode sweep, only the overhead can be calibrated
+        self.overhead = max(mean_y - self.scale * mean_x, 0)
+
+
+def format_duration(seconds):
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class Progress:
+    """Prints how many experiments of a sweep are done and the ETA. costs maps every experiment to its predicted
+    wall time, and parallelism is how many of them run at the same time"""
+    def __init__(self, costs, parallelism=1):
+        self.__costs = costs
+        self.__parallelism = parallelism
+        self.__remaining = sum(costs.values())
+        self.__finished = 0
+        self.__done = 0
+        self.__start = time.time()
+        self.__lock = threading.Lock()
+
+    def get_eta(self):
+        elapsed = time.time() - self.__start
+        if self.__finished == 0 or elapsed == 0:
+            return self.__remaining / self.__parallelism
+        # how fast predicted work actually gets done so far, which also corrects the model for this sweep
+        rate = self.__finished / elapsed
+        return self.__remaining / rate
+
+    def start(self):
+        print(f"{len(self.__costs)} experiments, ETA {format_duration(self.get_eta())}")
+
+    def finish(self, key):
+        # called from the threads of parallel sweeps
+        with self.__lock:
+            cost = self.__costs[key]
+            self.__remaining -= cost
+            self.__finished += cost
+            self.__done += 1
+            elapsed = time.time() - self.__start
+            print(f"[{self.__done}/{len(self.__costs)}] {format_duration(elapsed)} elapsed, "
+                  f"ETA {format_duration(self.get_eta())}")
@@ -0,0 +1,342 @@
+# Mininet topology and experiment setup. only imported when running in Mininet
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import mininet.topo
+import mininet.net
+import mininet.node
+import mininet.link
+import mininet.util
+import mininet.clean
+import mininet.log
+
+from experiment import get_queue_size, get_iperf3_server_command, get_iperf3_client_cmd, check_output, \
+    get_tcp_table_command, wait_until_listening, record_run, record_queue_summary, get_senders, record_flow_summary, \
+    record_journal, timed_phase
+import qdisc
+import tracing
+from tcpinfo import get_sampler_commands, get_tcpinfo_filename
+from sweep import SESSION_DONE
+from util import get_filename, get_temp_filename
+
+
+def get_node_name(name, configs):
+    # when running as part of a parallel sweep, every node needs a unique name
+    # so that interfaces (e.g. s1-eth2) and OVS bridges don't collide across jobs
+    if configs.job_id is None:
+        return name
+    return f"{name}j{configs.job_id}"
+
+
+def get_ip_base(configs):
+    # the senders are in the root namespace by default, so concurrent jobs need non-overlapping subnets
+    if configs.job_id is None:
+        return "10.0.0.0/8"
+    return f"10.{configs.job_id + 1}.0.0/16"
+
+
+def get_bottleneck_params(configs):
+    # keyi: need to convert to number of bytes, then divided by the MTU to obtain number of packets
+    # mininet does the following parameter passing to tc:
+    # 'limit %d' % max_queue_size if max_queue_size is not None
+    # which produces the following command (e.g.)
+    # tc qdisc add dev s1-eth2  parent 5:1  handle 10: netem delay 75.0ms limit XX
+    # based on man tc-netem, limit is specified by the number of packets, hence we need
+    # to do a conversion
+    max_queue_size = get_queue_size(configs.buffer_size)
+    if configs.debug:
+        print(f"max_queue_size: {max_queue_size}")
+    return dict(bw=configs.bw, delay="{0}ms".format(configs.rtt / 2),
+                loss=(configs.loss * 100) if configs.loss > 0 else None,
+                max_queue_size=max_queue_size, use_tbf=True)
+
+
+class Topology(mininet.topo.Topo):
+    def __init__(self, config):
+        self.config = config
+        # in Section 3.1, the paper mentioned that the delay between the senders and h3 is 40us
+        self._min_delay = "{0}us".format(40 / 2)
+        super(Topology, self).__init__()
+
+    def build(self):
+        senders = get_senders(self.config)
+        # we don't use namespace since it removes the kernel count for tcp transmission. with --senders, the senders
+        # get their own namespaces. in the root namespace all of them would share the route, and with it the link,
+        # of the first one
+        in_namespace = self.config.senders is not None
+        h1 = self.addHost(get_node_name(senders[0].name, self.config), inNamespace=in_namespace)
+        h3 = self.addHost(get_node_name("h3", self.config), server=self.config.remote_host,
+                          user=self.config.remote_user, port=self.config.remote_host_port, inNamespace=True)
+        if self.config.job_id is None:
+            s1 = self.addSwitch("s1")
+        else:
+            # the default dpid is derived from the first number in the name, which is the same for every job
+            s1 = self.addSwitch(get_node_name("s1", self.config), dpid="%016x" % (self.config.job_id + 1))
+        # [3.1] Host links have 1Gbps peak BW.
+        self.addLink(h1, s1, bw=1000, delay=self._min_delay)
+        self.addLink(s1, h3, **get_bottleneck_params(self.config))
+
+        for sender in senders[1:]:
+            host = self.addHost(get_node_name(sender.name, self.config), inNamespace=in_namespace)
+            self.addLink(host, s1, bw=1000, delay=self._min_delay)
+
+    def get_senders(self):
+        return [sender.name for sender in get_senders(self.config)]
+
+
+def setup_mininet_iperf_server(node, ports, configs):
+    processes = []
+    for port in ports:
+        cmd = get_iperf3_server_command(port)
+        # prevent blocking
+        if configs.debug:
+            print(node.name + ":", cmd)
+            processes.append(node.popen(cmd, stdout=sys.stdout, stderr=sys.stderr))
+        else:
+            processes.append(node.popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        tracing.process_started(processes[-1], f"{node.name} iperf3 server", cmd.split())
+    return processes
+
+
+def setup_client(node_from: mininet.node.Node, node_to: mininet.node.Node, configs, port, filename, cc):
+    target_ip = node_to.IP()
+    # we output json file
+    # mtu 1500
+    # no delay
+    # window 16Mb
+    args = get_iperf3_client_cmd(target_ip, port, filename, cc, configs)
+    if configs.debug:
+        print(f"setup_client: {node_from.name}: {' '.join(args)}")
+    p = node_from.popen(args, stderr=sys.stderr, stdout=sys.stdout)
+    tracing.process_started(p, f"{node_from.name} iperf3", args)
+    return p
+
+
+def setup_nodes(net: mininet.net.Mininet, configs):
+    senders = get_senders(configs)
+    nodes = [net.get(get_node_name(sender.name, configs)) for sender in senders]
+    h3 = net.get(get_node_name("h3", configs))
+    results = [get_filename(sender.name, configs) for sender in senders]
+    # iperf3 appends to its log file, so remove what an interrupted run left behind
+    for filename in results:
+        if os.path.exists(get_temp_filename(filename)):
+            os.remove(get_temp_filename(filename))
+    ports = [sender.port for sender in senders]
+    with tracing.span("servers"):
+        servers = setup_mininet_iperf_server(h3, ports, configs)
+        # the servers run in the h3 namespace, so check its TCP table
+        latency = wait_until_listening(lambda: h3.cmd(get_tcp_table_command()), ports, configs.ready_timeout)
+    if configs.debug:
+        print(f"{h3.name}: servers ready after {latency:.3f}s")
+    samplers = []
+    if configs.tcpinfo > 0:
+        # the senders may have their own namespaces, so sample from the nodes
+        for node, sender, filename in zip(nodes, senders, results):
+            commands = get_sampler_commands(sender.port, get_tcpinfo_filename(filename), configs.tcpinfo)
+            samplers.append(node.popen(commands, stdout=subprocess.DEVNULL, stderr=sys.stderr))
+            tracing.process_started(samplers[-1], f"{node.name} tcpinfo sampler", commands)
+    if configs.queue > 0:
+        # the bottleneck queue is on the s1 side of the s1-h3 link. the switch is in the root namespace
+        s1 = net.get(get_node_name("s1", configs))
+        link = net.linksBetween(s1, h3)[0]
+        intf = link.intf1 if link.intf1.node == s1 else link.intf2
+        commands = qdisc.get_sampler_commands(intf.name, qdisc.get_queue_filename(results[0]), configs.queue)
+        samplers.append(subprocess.Popen(commands, stderr=sys.stderr))
+        tracing.process_started(samplers[-1], "queue sampler", commands)
+    start_time = time.time()
+    record_run(configs, ready_latency=latency, start_time=start_time)
+    # all the clients start at once
+    clients = [setup_client(node, h3, configs, sender.port, filename, sender.cc)
+               for node, sender, filename in zip(nodes, senders, results)]
+
+    processes = [servers, clients, samplers, start_time]
+    return processes
+
+
+def stop_mininet_iperf_server(net: mininet.net.Mininet, processes, configs):
+    servers, clients, samplers, start_time = processes
+    with timed_phase(configs, "traffic"):
+        for p in clients:
+            p.wait()
+            tracing.process_finished(p)
+        end_time = time.time()
+    with timed_phase(configs, "teardown"):
+        for p in samplers:
+            p.terminate()
+            p.wait()
+            tracing.process_finished(p)
+        if configs.queue > 0:
+            record_queue_summary(configs, qdisc.get_queue_filename(get_filename("h1", configs)), start_time,
+                                 end_time)
+        for p in servers:
+            p.kill()
+            p.wait()
+            tracing.process_finished(p)
+        h3 = net.get(get_node_name("h3", configs))
+        # only kill our own servers, other jobs may be running at the same time
+        for sender in get_senders(configs):
+            h3.cmd(f"pkill -f 'iperf3 -s -p {sender.port} '")
+
+
+def cleanup_mininet(net: mininet.net.Mininet, processes, configs):
+    stop_mininet_iperf_server(net, processes, configs)
+    stop_mininet(net, configs)
+
+
+def stop_mininet(net: mininet.net.Mininet, configs):
+    if configs.job_id is None:
+        with timed_phase(configs, "cleanup"):
+            mininet.clean.cleanup()
+    else:
+        # other jobs are running at the same time, only tear down what belongs to us
+        with timed_phase(configs, "teardown"):
+            net.stop()
+
+
+def abort_mininet(net: mininet.net.Mininet, processes, configs):
+    # the run was interrupted, e.g. by the SIGTERM of a lost lease. the processes are killed instead of waited for,
+    # and the bridges, namespaces and iperf3 ports of the job are freed for the next run on this slot
+    if processes is not None:
+        servers, clients, samplers, _ = processes
+        for p in clients + samplers + servers:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+        h3 = net.get(get_node_name("h3", configs))
+        for sender in get_senders(configs):
+            h3.cmd(f"pkill -f 'iperf3 -s -p {sender.port} '")
+    stop_mininet(net, configs)
+
+
+def reconfigure_bottleneck(net: mininet.net.Mininet, configs):
+    s1 = net.get(get_node_name("s1", configs))
+    h3 = net.get(get_node_name("h3", configs))
+    params = get_bottleneck_params(configs)
+    # TCLink applies the parameters to both ends. TCIntf.config replaces the existing qdiscs
+    for link in net.linksBetween(s1, h3):
+        link.intf1.config(**params)
+        link.intf2.config(**params)
+
+
+def reset_tcp_state(net: mininet.net.Mininet, configs):
+    # the kernel caches ssthresh/RTT per destination, which would leak from one run to the next
+    nodes = [net.get(get_node_name(sender.name, configs)) for sender in get_senders(configs)]
+    nodes.append(net.get(get_node_name("h3", configs)))
+    for node in nodes:
+        node.cmd("sysctl -q -w net.ipv4.tcp_no_metrics_save=1")
+        node.cmd("ip tcp_metrics flush all")
+
+
+def start_mininet(configs):
+    topology = Topology(configs)
+    if configs.job_id is None:
+        # clean up previous mininet runs in case of crashes
+        with timed_phase(configs, "cleanup"):
+            mininet.clean.cleanup()
+    with timed_phase(configs, "setup"):
+        with tracing.span("build topology"):
+            if configs.job_id is None:
+                net = mininet.net.Mininet(topology, host=mininet.node.CPULimitedHost, link=mininet.link.TCLink)
+            else:
+                # the sweep driver cleans up once before starting the jobs. a controller listens on a fixed port,
+                # so parallel jobs use standalone bridges instead
+                net = mininet.net.Mininet(topology, host=mininet.node.CPULimitedHost, link=mininet.link.TCLink,
+                                          switch=mininet.node.OVSBridge, controller=None,
+                                          ipBase=get_ip_base(configs))
+        with tracing.span("net.start"):
+            net.start()
+
+        if configs.debug:
+            # test out the component
+            mininet.util.dumpNetConnections(net)
+            with tracing.span("pingAll"):
+                net.pingAll()
+    return net
+
+
+def run_mininet(configs):
+    if configs.mininet_debug:
+        mininet.log.setLogLevel("debug")
+    net = start_mininet(configs)
+    processes = None
+    try:
+        with timed_phase(configs, "setup"):
+            processes = setup_nodes(net, configs)
+        if configs.mininet_debug:
+            mininet.log.setLogLevel("error")
+        stop_mininet_iperf_server(net, processes, configs)
+    except BaseException:
+        abort_mininet(net, processes, configs)
+        raise
+
+    # clean up at the end
+    stop_mininet(net, configs)
+
+
+# experiment parameters that can change between runs of a session
+session_param_names = ["rtt", "bw", "buffer_size", "loss", "output", "repetition"]
+
+
+def read_session_params(lines):
+    # the experiment parameters of every non-empty line
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        params = json.loads(line)
+        for name in params:
+            assert name in session_param_names, f"{name} cannot be changed in a session"
+        yield params
+
+
+def run_session(configs):
+    # build the topology once and run one experiment per JSON object read from stdin,
+    # reconfiguring the bottleneck link in place between runs
+    assert configs.remote_host == "localhost", "Session mode only works with Mininet"
+    if configs.mininet_debug:
+        mininet.log.setLogLevel("debug")
+    # building the topology is counted towards the first run, and traced with it
+    topology_configs = argparse.Namespace(**{**vars(configs), "phases": {}})
+    if configs.trace:
+        tracing.start()
+    net = start_mininet(topology_configs)
+    if configs.mininet_debug:
+        mininet.log.setLogLevel("error")
+    try:
+        for index, params in enumerate(read_session_params(sys.stdin)):
+            phases = dict(topology_configs.phases) if index == 0 else {}
+            run_configs = argparse.Namespace(**{**vars(configs), **params, "phases": phases})
+            if configs.trace and not tracing.is_enabled():
+                tracing.start()
+            if not os.path.exists(run_configs.output):
+                os.makedirs(run_configs.output, exist_ok=True)
+
+            record_journal(run_configs, "running", duration=run_configs.time, total_size=run_configs.total_size)
+            try:
+                with timed_phase(run_configs, "setup"):
+                    reconfigure_bottleneck(net, run_configs)
+                    reset_tcp_state(net, run_configs)
+                    processes = setup_nodes(net, run_configs)
+                stop_mininet_iperf_server(net, processes, run_configs)
+                with timed_phase(run_configs, "check"):
+                    goodputs = check_output(run_configs)
+                    if len(goodputs) > 1:
+                        record_flow_summary(run_configs, goodputs)
+            except BaseException as ex:
+                record_journal(run_configs, "failed", error=repr(ex))
+                raise
+            finally:
+                tracing.save(tracing.get_trace_filename(get_filename("h1", run_configs)))
+            record_journal(run_configs, "done", phases=run_configs.phases)
+            # run shows the progress of the sweep from these. stdout is a pipe, so the other output is flushed too
+            print(SESSION_DONE, flush=True)
+    finally:
+        if configs.job_id is None:
+            mininet.clean.cleanup()
+        else:
+            net.stop()
@@ -0,0 +1,226 @@
+# parts of the experiment shared by the Mininet and the LAN setup
+
+import collections
+import contextlib
+import math
+import os
+import posixpath
+import sys
+import time
+
+import qdisc
+import tracing
+from agent import parse_listening_ports
+from sshpool import get_ssh_commands, REMOTE_SAMPLER_PATH
+from util import get_iperf_metrics, get_filename, get_sender_names, get_jain_index, get_temp_filename, \
+    get_result_name, is_complete_result, append_journal, append_run_record
+
+
+# MTU - 40 bytes of TCP header size
+PACKET_SIZE = 1500 - 40
+# how long the queue sampler on a LAN switch may take to send its first sample, in s
+QUEUE_SAMPLER_TIMEOUT = 10
+
+
+def get_queue_size(buffer_size):
+    return int(math.ceil(buffer_size * 1000 * 1000 / PACKET_SIZE))
+
+
+# a sender host, its congestion control and the port of its iperf3 server on h3
+Sender = collections.namedtuple("Sender", ["name", "cc", "port"])
+
+
+def get_senders(configs):
+    if configs.senders is None:
+        senders = [Sender("h1", configs.cc, configs.port)]
+        if configs.h2:
+            senders.append(Sender("h2", configs.h2_cc, configs.port + 1))
+        return senders
+    # the last congestion control is used for the remaining senders, e.g. bbr cubic is one bbr against cubic flows
+    ccs = configs.sender_cc or [configs.cc]
+    return [Sender(name, ccs[min(i, len(ccs) - 1)], configs.port + i)
+            for i, name in enumerate(get_sender_names(configs.senders))]
+
+
+def get_iperf3_server_command(port):
+    # iperf3 only allow one test per server
+    return f"iperf3 -s -p {port} -4"
+
+
+def get_iperf3_server_commands(port1, port2):
+    return get_iperf3_server_command(port1), get_iperf3_server_command(port2)
+
+
+def get_lan_netem_args(configs):
+    # add delay
+    args = ["delay", f"{configs.rtt / 2}ms"]
+    # add buffer size
+    args += ["limit", f"{get_queue_size(configs.buffer_size)}"]
+    # bandwidth
+    args += ["rate", f"{configs.bw}Mbit"]
+    if configs.loss > 0:
+        args += ["loss", f"{int(configs.loss * 100)}%"]
+    return args
+
+
+def get_lan_ports(configs):
+    return [configs.port, configs.port + 1] if configs.h2 else [configs.port]
+
+
+def remove_lan_results(configs):
+    h1_result = get_temp_filename(get_filename("h1", configs))
+    h2_result = get_temp_filename(get_filename("h2", configs))
+    # iperf3 appends to its log file, so remove what an interrupted run left behind
+    for filename in {h1_result, h2_result}:
+        if os.path.exists(filename):
+            os.remove(filename)
+    # the LAN subnet is 10.x.x.x
+    if configs.remote_host.split(".")[0] != "10" and not configs.agent_local:
+        assert os.path.exists(configs.remote_ssh_key)
+
+
+def get_tcp_table_command():
+    # prints the TCP sockets of the network namespace it runs in. tcp6 doesn't exist if IPv6 is disabled
+    return "cat /proc/net/tcp /proc/net/tcp6 2>/dev/null"
+
+
+def wait_until_listening(read_tcp_table, ports, timeout):
+    """Poll read_tcp_table(), which returns the content of /proc/net/tcp of the server, until all the ports are
+    listening. Returns how long it took in seconds"""
+    start = time.time()
+    while True:
+        missing = set(ports) - parse_listening_ports(read_tcp_table())
+        if not missing:
+            return time.time() - start
+        if time.time() - start > timeout:
+            raise RuntimeError(f"iperf3 ports {sorted(missing)} are not listening after {timeout}s")
+        time.sleep(0.01)
+
+
+def record_run(configs, **fields):
+    # one JSON line per experiment in runs.jsonl of the output directory. the result loaders only read *.json
+    append_run_record(configs.output, get_result_name(get_filename("h1", configs)), **fields)
+
+
+def record_journal(configs, state, **fields):
+    append_journal(configs.output, get_result_name(get_filename("h1", configs)), state, **fields)
+
+
+@contextlib.contextmanager
+def timed_phase(configs, name):
+    # wall time of a step of the experiment, e.g. setup or traffic, summed into configs.phases. the phases are
+    # recorded with the done state in the journal, and traced with --trace
+    start = time.time()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        configs.phases[name] = configs.phases.get(name, 0) + time.time() - start
+
+
+def record_queue_summary(configs, filename, start_time, end_time, clock_offset=None):
+    # the samples are stamped by the clock of the machine that took them. on a LAN switch, that clock is clock_offset
+    # ahead of this one. skip the slow start, which iperf3 omits as well
+    offset = clock_offset or 0
+    summary = qdisc.get_queue_summary(filename, configs.bw, configs.rtt, start_time + 1 + offset, end_time + offset)
+    if clock_offset is not None:
+        summary["queue_clock_offset"] = clock_offset
+    record_run(configs, **summary)
+
+
+def get_first_sample_time(filename):
+    # None until the sampler has streamed its first sample
+    with open(filename, "rb") as f:
+        data = f.read(qdisc.HEADER.size + qdisc.RECORD.size)
+    if len(data) < qdisc.HEADER.size + qdisc.RECORD.size:
+        return None
+    return qdisc.RECORD.unpack_from(data, qdisc.HEADER.size)[0]
+
+
+def get_queue_clock_offset(sample_time):
+    # the sample is taken right before it is sent, so this is off by the latency of the connection to the switch,
+    # instead of by the skew between the clocks
+    return sample_time - time.time()
+
+
+def wait_for_queue_sampler(filename, p, timeout=QUEUE_SAMPLER_TIMEOUT):
+    """Waits until the sampler p has streamed its first sample into filename, so that it runs before the traffic
+    starts. Returns the offset of the clock of the sampler's machine to this one, in s"""
+    start = time.time()
+    while True:
+        sample_time = get_first_sample_time(filename)
+        if sample_time is not None:
+            return get_queue_clock_offset(sample_time)
+        if p.poll() is not None:
+            raise RuntimeError(f"The queue sampler exited with {p.returncode}")
+        if time.time() - start > timeout:
+            raise RuntimeError(f"The queue sampler didn't send a sample within {timeout}s")
+        time.sleep(0.01)
+
+
+def get_copy_commands(host, remote_path, configs, port=22, username="mininet"):
+    # copies stdin, e.g. a script that only uses the standard library, to a LAN machine. the scripts are run with
+    # sudo, so the directory has to belong to the remote user and nobody else may write to it. the copy replaces the
+    # old one in one step, so that a running daemon or a concurrent copy never sees half a file
+    dirname = posixpath.dirname(remote_path)
+    commands = ["umask", "077", "&&", "mkdir", "-p", dirname, "&&", "test", "-O", dirname, "&&", "test", "!", "-L",
+                dirname, "&&", "chmod", "700", dirname, "&&", "cat", ">", f"{remote_path}.part", "&&", "mv", "-f",
+                f"{remote_path}.part", remote_path]
+    return get_ssh_commands(host, commands, port, debug=configs.debug, username=username,
+                            id_file=configs.remote_ssh_key)
+
+
+def get_switch_queue_sampler_commands(configs):
+    # the bottleneck queue is on the switch. qdisc.py has to be copied there first, and streams the samples back
+    if configs.agent_local:
+        return qdisc.get_sampler_commands(configs.remote_eth, "-", configs.queue)
+    commands = qdisc.get_sampler_commands(configs.remote_eth, "-", configs.queue, python="python3",
+                                          path=REMOTE_SAMPLER_PATH)
+    return get_ssh_commands(configs.switch, ["sudo"] + commands, id_file=configs.remote_ssh_key)
+
+
+def get_iperf3_client_cmd(target_ip, port, filename, cc, configs):
+    # the result is written next to filename and moved into place by check_output
+    logfile = get_temp_filename(filename)
+    if configs.adaptive:
+        # stream the interval reports so that the wrapper can stop the client once it converges
+        assert configs.total_size == 0, "Adaptive duration cannot be used together with total size"
+        args = ["iperf3", "-c", f"{target_ip}", "-C", f"{cc}", f"-p {port}",
+                "-N", "-M", f"{PACKET_SIZE}", "-i", f"{configs.adaptive_interval}", "-J", "--json-stream",
+                "--forceflush", "-4"]
+    else:
+        args = ["iperf3", "-c", f"{target_ip}", "-C", f"{cc}", f"-p {port}",
+                "-N", "-M", f"{PACKET_SIZE}",  "-i", "0", "-J", "-4", "--logfile", f"{logfile}"]
+    if configs.total_size > 0:
+        # no omit period. iperf3 would send the total size on top of what it sends while omitting, and the slow
+        # start is part of the flow completion time
+        args += ["-n", f"{configs.total_size}M"]
+    else:
+        args += ["-t", f"{configs.time}"]
+        # ignore the slow start, which is approximately 1s
+        args += ["-O", "1"]
+    if configs.remote_host == "localhost":
+        args += ["--window", "16M"]
+    if configs.adaptive:
+        adaptive = os.path.join(os.path.dirname(os.path.abspath(__file__)), "adaptive.py")
+        args = [sys.executable, adaptive, "--logfile", logfile, "--window", f"{configs.adaptive_window}",
+                "--tolerance", f"{configs.adaptive_tolerance}", "--"] + args
+    return args
+
+
+def check_output(configs):
+    # check if we generate the outputs properly, then move them into place. results only get their final name once
+    # all of them are complete, so an interrupted run never looks finished. returns the goodput of every sender
+    filenames = {sender.name: get_filename(sender.name, configs) for sender in get_senders(configs)}
+    for filename in filenames.values():
+        if not is_complete_result(get_temp_filename(filename)):
+            raise RuntimeError(f"{get_temp_filename(filename)} is missing or incomplete")
+    for filename in filenames.values():
+        os.replace(get_temp_filename(filename), filename)
+    return {name: get_iperf_metrics(filename)[0] for name, filename in filenames.items()}
+
+
+def record_flow_summary(configs, goodputs):
+    # how the senders shared the bottleneck
+    values = list(goodputs.values())
+    record_run(configs, goodput=goodputs, aggregate_goodput=sum(values), jain_index=get_jain_index(values))
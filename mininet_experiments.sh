@@ -33,8 +33,8 @@ sudo ./run mininet -t 60 -c cubic --h2 --h2-cc bbr --size-range 0.01 0.1 1 5 10
 sudo ./run mininet --rtt 25 --size 10 --bw 100 --loss-range 0 0.01 0.02 0.05 0.12 0.18 0.25 0.35 0.45 -o $1/figure7/reno/ -c reno;
 sudo ./run mininet --rtt 25 --size 10 --bw 100 --loss-range 0 0.01 0.02 0.05 0.12 0.18 0.25 0.35 0.45 -o $1/figure7/cubic/ -c cubic;
 sudo ./run mininet --rtt 25 --size 10 --bw 100 --loss-range 0 0.01 0.02 0.05 0.12 0.18 0.25 0.35 0.45 -o $1/figure7/bbr/ -c bbr;
-sudo ./run mininet --rtt 25 --size 10 --bw 100 --loss-range 0 0.01 0.02 0.05 0.12 0.18 0.25 0.35 0.45 -o $1/figure7/bbr_3_2/ -c bbr_3_2;
-sudo ./run mininet --rtt 25 --size 10 --bw 100 --loss-range 0 0.01 0.02 0.05 0.12 0.18 0.25 0.35 0.45 -o $1/figure7/bbr_11_10/ -c bbr_11_10;
+# builds and loads bbr_3_2 and bbr_11_10 and runs each into $1/figure7/<variant>
+sudo ./run mininet --rtt 25 --size 10 --bw 100 --loss-range 0 0.01 0.02 0.05 0.12 0.18 0.25 0.35 0.45 -o $1/figure7/ --bbr-grid up_gain=3/2,11/10;
 
 # Figure 8 run #3
 sudo ./run mininet -t 60 -c bbr --h2 --h2-cc cubic --size-range 0.01 0.1 1 5 10 50 100 --loss-range 0 --rtt 20 --bw 1000 -o $1/figure8_run3
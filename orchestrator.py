@@ -0,0 +1,226 @@
+# asyncio version of the LAN/shared experiment. the steps on different machines run at the same time, and
+# the netem qdiscs are always cleared at the end, even if a step fails or the run is interrupted
+
+import asyncio
+import signal
+import subprocess
+import sys
+import time
+
+from experiment import get_iperf3_server_commands, get_iperf3_client_cmd, get_tcp_table_command, record_run, \
+    get_lan_netem_args, get_lan_ports, remove_lan_results, get_copy_commands, get_switch_queue_sampler_commands, \
+    record_queue_summary, timed_phase, get_first_sample_time, get_queue_clock_offset, QUEUE_SAMPLER_TIMEOUT
+import qdisc
+import tracing
+from agent import parse_listening_ports
+from sshpool import get_ssh_commands, get_remote_username, REMOTE_SAMPLER_PATH
+from tcpinfo import get_sampler_commands, get_tcpinfo_filename
+from util import get_filename
+
+
+async def gather_all(*aws):
+    # like asyncio.gather, but the other steps are cancelled as soon as one fails
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def start_process(commands, configs, name):
+    if configs.debug:
+        print(name + ":", " ".join(commands))
+        p = await asyncio.create_subprocess_exec(*commands, stdout=sys.stdout, stderr=sys.stderr)
+    else:
+        p = await asyncio.create_subprocess_exec(*commands, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    tracing.process_started(p, name, commands)
+    return p
+
+
+async def stop_process(p):
+    if p.returncode is None:
+        p.kill()
+    await p.wait()
+    tracing.process_finished(p)
+
+
+async def wait_process(p):
+    returncode = await p.wait()
+    tracing.process_finished(p)
+    return returncode
+
+
+async def run_command(commands, configs, name, check=True, stdin=None):
+    # returns the stdout of the command
+    if configs.debug:
+        print(name + ":", " ".join(commands))
+    p = await asyncio.create_subprocess_exec(*commands, stdin=stdin, stdout=subprocess.PIPE,
+                                             stderr=sys.stderr if configs.debug else subprocess.DEVNULL)
+    tracing.process_started(p, name, commands)
+    try:
+        stdout, _ = await p.communicate()
+    except asyncio.CancelledError:
+        await stop_process(p)
+        raise
+    tracing.process_finished(p)
+    if check and p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, commands)
+    return stdout.decode()
+
+
+def get_remote_host_commands(commands, configs):
+    return get_ssh_commands(configs.remote_host, commands, configs.remote_host_port,
+                            username=get_remote_username(configs.remote_host), id_file=configs.remote_ssh_key)
+
+
+def get_netem_commands(configs, clear=False):
+    # (name, commands) of the tc command on every machine. limit the senders to 1Gbps
+    action = ["del"] if clear else ["add"]
+    sender_args = [] if clear else ["rate", "1Gbit"]
+    switch_args = [] if clear else get_lan_netem_args(configs)
+    tc_cmd = ["sudo", "tc", "qdisc"] + action + ["dev", "eth0", "root", "netem"] + sender_args
+    commands = [("h1", tc_cmd)]
+    # apply this to h2 as well, if enabled
+    if configs.h2:
+        commands.append(("h2", get_ssh_commands(configs.h2_host, tc_cmd, id_file=configs.remote_ssh_key)))
+    tc_cmd = ["sudo", "tc", "qdisc"] + action + ["dev", configs.remote_eth, "root", "netem"] + switch_args
+    commands.append(("switch", get_ssh_commands(configs.switch, tc_cmd, id_file=configs.remote_ssh_key)))
+    return commands
+
+
+async def apply_netem(configs):
+    await gather_all(*[run_command(commands, configs, name) for name, commands in get_netem_commands(configs)])
+
+
+async def clear_netem(configs):
+    # the qdiscs may not exist, e.g. when setup failed half way
+    await asyncio.gather(*[run_command(commands, configs, name, check=False)
+                           for name, commands in get_netem_commands(configs, clear=True)])
+
+
+async def start_servers(configs, servers):
+    # servers is filled in as they start, so that the caller can stop them if another step fails
+    # killall the iperf3 server first
+    await run_command(get_remote_host_commands(["killall", "iperf3"], configs), configs, configs.remote_host,
+                      check=False)
+    cmd1, cmd2 = get_iperf3_server_commands(configs.port, configs.port + 1)
+    for cmd in [cmd1, cmd2] if configs.h2 else [cmd1]:
+        servers.append(await start_process(get_remote_host_commands(cmd.split(), configs), configs,
+                                           configs.remote_host))
+
+
+async def deploy_queue_sampler(configs):
+    if configs.queue <= 0 or configs.agent_local:
+        return
+    with open(qdisc.__file__, "rb") as f:
+        await run_command(get_copy_commands(configs.switch, REMOTE_SAMPLER_PATH, configs), configs, "switch",
+                          stdin=f)
+
+
+async def start_queue_sampler(configs):
+    filename = qdisc.get_queue_filename(get_filename("h1", configs))
+    commands = get_switch_queue_sampler_commands(configs)
+    with open(filename, "wb") as f:
+        p = await asyncio.create_subprocess_exec(*commands, stdout=f, stderr=sys.stderr)
+    tracing.process_started(p, "queue sampler", commands)
+    return p
+
+
+async def wait_for_queue_sampler(configs, p):
+    # same as experiment.wait_for_queue_sampler
+    filename = qdisc.get_queue_filename(get_filename("h1", configs))
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    while True:
+        sample_time = get_first_sample_time(filename)
+        if sample_time is not None:
+            return get_queue_clock_offset(sample_time)
+        if p.returncode is not None:
+            raise RuntimeError(f"The queue sampler exited with {p.returncode}")
+        if loop.time() - start > QUEUE_SAMPLER_TIMEOUT:
+            raise RuntimeError(f"The queue sampler didn't send a sample within {QUEUE_SAMPLER_TIMEOUT}s")
+        await asyncio.sleep(0.01)
+
+
+async def wait_until_ready(configs):
+    # same as experiment.wait_until_listening, with the TCP table read over ssh
+    loop = asyncio.get_running_loop()
+    commands = get_remote_host_commands([get_tcp_table_command()], configs)
+    ports = set(get_lan_ports(configs))
+    start = loop.time()
+    while True:
+        table = await run_command(commands, configs, configs.remote_host, check=False)
+        missing = ports - parse_listening_ports(table)
+        if not missing:
+            return loop.time() - start
+        if loop.time() - start > configs.ready_timeout:
+            raise RuntimeError(f"iperf3 ports {sorted(missing)} are not listening after {configs.ready_timeout}s")
+        await asyncio.sleep(0.01)
+
+
+async def run_clients(configs, ready_latency):
+    hosts = [("h1", configs.cc), ("h2", configs.h2_cc)]
+    clients = []
+    samplers = []
+    clock_offset = None
+    try:
+        if configs.tcpinfo > 0:
+            # only h1 runs on this machine
+            commands = get_sampler_commands(configs.port, get_tcpinfo_filename(get_filename("h1", configs)),
+                                            configs.tcpinfo)
+            samplers.append(await asyncio.create_subprocess_exec(*commands, stderr=sys.stderr))
+            tracing.process_started(samplers[-1], "tcpinfo sampler", commands)
+        if configs.queue > 0:
+            samplers.append(await start_queue_sampler(configs))
+            clock_offset = await wait_for_queue_sampler(configs, samplers[-1])
+        start_time = time.time()
+        record_run(configs, ready_latency=ready_latency, start_time=start_time)
+        for (name, cc), port in zip(hosts, get_lan_ports(configs)):
+            commands = get_iperf3_client_cmd(configs.remote_host, port, get_filename(name, configs), cc, configs)
+            if configs.debug:
+                print(name, " ".join(commands))
+            clients.append(await asyncio.create_subprocess_exec(*commands, stdout=sys.stdout, stderr=sys.stderr))
+            tracing.process_started(clients[-1], f"{name} iperf3", commands)
+        returncodes = await asyncio.gather(*[wait_process(p) for p in clients])
+        end_time = time.time()
+    finally:
+        await asyncio.gather(*[stop_process(p) for p in clients])
+        for p in samplers:
+            if p.returncode is None:
+                p.terminate()
+        await asyncio.gather(*[p.wait() for p in samplers])
+        for p in samplers:
+            tracing.process_finished(p)
+    for (name, _), returncode in zip(hosts, returncodes):
+        if returncode != 0:
+            print(f"{name}: iperf3 exited with {returncode}", file=sys.stderr)
+    if configs.queue > 0:
+        record_queue_summary(configs, qdisc.get_queue_filename(get_filename("h1", configs)), start_time, end_time,
+                             clock_offset)
+
+
+async def run_lan(configs):
+    # sudo kill sends SIGTERM, which should clean up the same way as Ctrl-C
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
+
+    remove_lan_results(configs)
+    servers = []
+    try:
+        with timed_phase(configs, "setup"):
+            # leftovers from a crashed run make tc qdisc add fail
+            await clear_netem(configs)
+            await gather_all(start_servers(configs, servers), apply_netem(configs), deploy_queue_sampler(configs))
+            latency = await wait_until_ready(configs)
+        if configs.debug:
+            print(f"{configs.remote_host}: servers ready after {latency:.3f}s")
+        with timed_phase(configs, "traffic"):
+            await run_clients(configs, latency)
+    finally:
+        with timed_phase(configs, "teardown"):
+            # shielded, so that a SIGTERM during the cleanup doesn't leave the qdiscs behind
+            await asyncio.shield(gather_all(clear_netem(configs), *[stop_process(p) for p in servers]))
+        loop.remove_signal_handler(signal.SIGTERM)
@@ -0,0 +1,109 @@
+# adaptive sweep planner. instead of running every config of the ranges, it starts from a coarse grid and only
+# refines the cells where the goodput gain of one congestion control over the other changes sign or is close to 0,
+# which is the boundary the Figure 5 heatmaps are about. configs are points of the grid spanned by the ranges, so
+# the results are named and plotted like the ones of a full sweep
+
+import itertools
+
+from plot import compute_gain
+
+
+def get_coarse_indices(size, step):
+    # always include both ends of the range
+    indices = list(range(0, size, step))
+    if indices[-1] != size - 1:
+        indices.append(size - 1)
+    return indices
+
+
+def get_gain(goodput1, goodput2):
+    if goodput2 == 0:
+        return float("inf") if goodput1 > 0 else 0
+    return compute_gain(goodput1, goodput2)
+
+
+class Planner:
+    """Plans batches of configs on the grid spanned by axes, a list of sorted value lists. Every config counts
+    against the budget, and a cell is only split if all of its new configs fit"""
+    def __init__(self, axes, budget, threshold=0.1, step=2):
+        self.axes = axes
+        self.budget = budget
+        self.threshold = threshold
+        self.__gains = {}
+        self.__planned = set()
+        # a cell is a (lo, hi) index pair per axis. single-value axes have lo == hi
+        pairs = []
+        for values in axes:
+            indices = get_coarse_indices(len(values), step)
+            pairs.append(list(zip(indices, indices[1:])) if len(indices) > 1 else [(0, 0)])
+        self.__cells = list(itertools.product(*pairs))
+
+    @staticmethod
+    def get_corners(cell):
+        return list(itertools.product(*[sorted({lo, hi}) for lo, hi in cell]))
+
+    @staticmethod
+    def split(cell):
+        # halve every axis that still has values between the ends of the cell
+        parts = []
+        for lo, hi in cell:
+            if hi - lo > 1:
+                mid = (lo + hi) // 2
+                parts.append([(lo, mid), (mid, hi)])
+            else:
+                parts.append([(lo, hi)])
+        points = itertools.product(*[sorted({index for part in axis for index in part}) for axis in parts])
+        return list(itertools.product(*parts)), list(points)
+
+    def get_values(self, point):
+        return tuple(values[index] for values, index in zip(self.axes, point))
+
+    def get_priority(self, cell):
+        """Returns the smallest absolute gain of the corners if the cell needs to be refined, otherwise None"""
+        if all(hi - lo <= 1 for lo, hi in cell):
+            return None
+        gains = [self.__gains.get(corner) for corner in self.get_corners(cell)]
+        if any(gain is None for gain in gains):
+            return None
+        closest = min(abs(gain) for gain in gains)
+        # the boundary runs through the cell if the corners disagree on the winner
+        if len({gain > 0 for gain in gains}) > 1 or closest < self.threshold:
+            return closest
+        return None
+
+    def next_batch(self):
+        """Returns the configs to run next as value tuples, in the order of the axes. Empty when the boundary is
+        resolved or the budget is used up"""
+        if not self.__planned:
+            points = sorted({corner for cell in self.__cells for corner in self.get_corners(cell)})
+            assert len(points) <= self.budget, f"The coarse grid has {len(points)} configs, which is over the " \
+                                               f"budget of {self.budget}"
+            self.__planned.update(points)
+            return [self.get_values(point) for point in points]
+        points = []
+        split = True
+        # the configs of a cell may all have been run for its neighbors already. then its subcells can be looked at
+        # right away
+        while split and not points:
+            split = False
+            candidates = [(self.get_priority(cell), cell) for cell in self.__cells]
+            candidates = sorted((priority, cell) for priority, cell in candidates if priority is not None)
+            for _, cell in candidates:
+                subcells, cell_points = self.split(cell)
+                new_points = [point for point in cell_points if point not in self.__planned]
+                if len(self.__planned) + len(new_points) > self.budget:
+                    # a cell further from the boundary may still fit
+                    continue
+                self.__planned.update(new_points)
+                points += new_points
+                self.__cells.remove(cell)
+                self.__cells += subcells
+                split = True
+        return [self.get_values(point) for point in points]
+
+    def add_result(self, values, goodput1, goodput2):
+        point = tuple(axis.index(value) for axis, value in zip(self.axes, values))
+        self.__gains[point] = get_gain(goodput1, goodput2)
+
+    def get_num_planned(self):
+        return len(self.__planned)
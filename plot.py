@@ -1,27 +1,47 @@
-import matplotlib
+# numpy, pandas, seaborn and matplotlib are imported where they are used, so that argument parsing
+# and figures that are skipped by batch don't pay for the imports
 import argparse
-import seaborn
-import pandas as pd
-import numpy as np
-from util import get_all_metrics, parse_name_config, config_param_names
+import hashlib
+import json
+import os
+import sys
+from util import get_all_metrics, split_metrics_by_host, parse_name_config, config_param_names, metric_names, \
+    latency_metric_names, fct_metric_names
 
-commands = ["heatmap", "line"]
+commands = ["heatmap", "line", "cdf"]
+# defaults of the optional arguments, used for figures listed in a batch manifest
+figure_defaults = {"debug": False, "add_total": False, "split_host": False, "logx": False, "logx_scale": 1e6,
+                   "allow_missing": False, "ratio": False}
 
 
 def get_configs():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(dest="command", description="Plot iperf graph", required=True)
+    p = subparsers.add_parser("batch", help="Render all figures listed in a manifest")
+    p.add_argument("-m", "--manifest", dest="manifest", required=True, type=str,
+                   help="JSON file with a list of figures under \"figures\". Each figure has the same fields as "
+                        "the heatmap/line arguments")
+    p.add_argument("-r", "--root", dest="root", default=".", type=str,
+                   help="Directory that input and output paths in the manifest are relative to")
+    p.add_argument("-j", "--jobs", dest="jobs", default=os.cpu_count(), type=int, help="Number of worker processes")
+    p.add_argument("-f", "--force", action="store_true", dest="force",
+                   help="Render every figure, even if its inputs haven't changed")
     for command in commands:
         p = subparsers.add_parser(command)
         p.add_argument("-o", "--out", dest="out", help="Output file", required=True)
         p.add_argument("-i", "--input", nargs="+", dest="input", help="Input directory", required=True)
-        p.add_argument("-x", help="X axis param name", required=True, dest="x")
-        p.add_argument("-y", help="Y axis param name", required=True, dest="y")
+        if command != "cdf":
+            p.add_argument("-x", help="X axis param name", required=True, dest="x")
+            p.add_argument("-y", help="Y axis param name", required=True, dest="y")
         p.add_argument("--debug", action="store_true", dest="debug")
 
         if command == "heatmap":
-            p.add_argument("-t", "--target", choices=["goodput", "rtt", "retransmits"], required=True,
-                           help="Target measurement", dest="target")
+            p.add_argument("-t", "--target", choices=list(target_columns), required=True,
+                           help="Target measurement. rtt is the mean RTT, rtt_p95 etc. need runs with --tcpinfo "
+                                "or --adaptive, fct and slowdown need runs with --total-size. fct and slowdown "
+                                "are shown as the ratio of the first input over the second", dest="target")
+            p.add_argument("--allow-missing", action="store_true", dest="allow_missing",
+                           help="Leave cells without results blank, e.g. for sweeps from run --refine-cc")
         if command == "line":
             p.add_argument("-n", "--names", nargs="+", help="Legend names. Has to match with inputs", required=True,
                            dest="names")
@@ -32,86 +52,106 @@ def get_configs():
             p.add_argument("--logx", action="store_true", dest="logx", help="If set, x axis will be in log")
             p.add_argument("--logx-scale", dest="logx_scale", type=int, default=1e6,
                            help="Multiple X-axis when plotting with --logx")
+        if command == "cdf":
+            p.add_argument("-n", "--names", nargs="+", help="Legend names. Has to match with inputs", required=True,
+                           dest="names")
+            p.add_argument("-t", "--target", choices=list(target_columns), default="fct", dest="target",
+                           help="Target measurement, over all the configs and repetitions of an input")
+            p.add_argument("--ratio", action="store_true", dest="ratio",
+                           help="Plot the ratio of the first input over the second for every result they both "
+                                "have, e.g. the BBR over CUBIC FCT")
 
     return parser.parse_args()
 
 
 def compute_gain(mat1, mat2):
     # in this case mat1 is bbr and mat2 is cubic
-    return np.divide(np.subtract(mat1, mat2), mat2)
+    return (mat1 - mat2) / mat2
 
 
 def compute_dec(mat1, mat2):
     # in this case mat1 is bbr and mat2 is cubic
-    return np.divide(np.subtract(mat2, mat1), mat2)
+    return (mat2 - mat1) / mat2
+
 
+def get_heatmap_dataframe(mat, x_values, y_values, x_name, y_name):
+    import pandas as pd
+    # rows are y values and columns are x values, which is how seaborn lays out the heatmap
+    return pd.DataFrame(mat, index=pd.Index(y_values, name=y_name), columns=pd.Index(x_values, name=x_name))
 
-def get_heatmap_dataframe(mat, x_values, y_values, names):
-    result = []
-    for y in range(len(y_values)):
-        for x in range(len(x_values)):
-            result.append((x_values[x], y_values[y], mat[y][x]))
 
-    return pd.DataFrame(result, columns=names)
+# metric tuple index and table column of each plot target. rtt is the mean RTT
+metric_columns = metric_names
+target_columns = {"goodput": "goodput", "rtt": "mean_rtt", "retransmits": "retransmits",
+                  **{name: name for name in latency_metric_names}, **{name: name for name in fct_metric_names}}
+latency_targets = {"rtt"} | set(latency_metric_names)
+fct_targets = set(fct_metric_names)
+target_labels = {"goodput": "Goodput (Mbps)", "retransmits": "Retr Number", "fct": "FCT (s)",
+                 "slowdown": "Slowdown", **{name: "RTT (ms)" for name in latency_targets}}
 
 
-def get_param_values(params, target_params: set):
-    param_values = {}
-    for param, name in params:
-        for param_name in config_param_names:
-            if param_name not in param_values:
-                param_values[param_name] = set()
-            param_values[param_name].add(getattr(param, param_name))
+def get_metrics_table(stats):
+    import pandas as pd
+    # one row per result with the parsed config and its metrics
+    rows = [tuple(parse_name_config(name)) + tuple(metric) for name, metric in stats.items()]
+    return pd.DataFrame(rows, columns=config_param_names + metric_columns)
 
+
+def check_param_values(table, target_params: set):
     # make sure the x and y is correct
     for param_name in config_param_names:
+        num_values = table[param_name].nunique()
+        if param_name == "repetition" and param_name not in target_params:
+            # repetitions of the same config are summarized by their median
+            continue
         if param_name in target_params:
-            assert len(param_values[param_name]) > 1
+            assert num_values > 1, f"{param_name} only has {num_values} value"
         else:
-            assert len(param_values[param_name]) == 1
-    return param_values
+            assert num_values == 1, f"{param_name} has {num_values} values but is not an axis"
+
+
+def get_missing_cells(mat, x_values, y_values):
+    import numpy as np
+    missing = set()
+    for y, x in np.argwhere(np.isnan(mat)):
+        missing.add((x_values[x], y_values[y]))
+    return missing
 
 
 def preprocess_heatmap_data(configs, stats):
+    import numpy as np
     # based on the names, figure out which two variables to use
-    params = [(parse_name_config(name), name) for name in stats if "h1" in name]
-    param_values = get_param_values(params, {configs.x, configs.y})
+    table = get_metrics_table(stats)
+    table = table[table["hostname"] == "h1"]
+    check_param_values(table, {configs.x, configs.y})
 
     # compute value matrix
-    x_values = list(param_values[configs.x])
-    y_values = list(param_values[configs.y])
-    x_values.sort()
-    y_values.sort()
-    mat = np.zeros(shape=(len(y_values), len(x_values)), dtype=np.float64)
-    for y, y_value in enumerate(y_values):
-        for x, x_value in enumerate(x_values):
-            # find the value
-            met = None
-            for param, name in params:
-                if getattr(param, configs.x) == x_value and getattr(param, configs.y) == y_value:
-                    # found it
-                    met = stats[name]
-            assert met is not None, "Unable to construct matrix"
-            if configs.target == "goodput":
-                mat[y][x] = met[0]
-            elif configs.target == "rtt":
-                mat[y][x] = met[1]
-            elif configs.target == "retransmits":
-                mat[y][x] = met[2]
-    return mat, x_values, y_values, params
-
-
-def plot_heatmap(configs):
+    x_values = sorted(table[configs.x].unique().tolist())
+    y_values = sorted(table[configs.y].unique().tolist())
+    column = target_columns[configs.target]
+    assert table[column].notna().any(), f"No {column} in the results"
+    # the median of the repetitions
+    df = table.pivot_table(index=configs.y, columns=configs.x, values=column, aggfunc="median")
+    mat = df.reindex(index=y_values, columns=x_values).to_numpy(dtype=np.float64)
+    missing = get_missing_cells(mat, x_values, y_values)
+    assert configs.allow_missing or len(missing) == 0, \
+        f"Unable to construct matrix, missing ({configs.x}, {configs.y}): {sorted(missing)}"
+    return mat, x_values, y_values, table
+
+
+def plot_heatmap(configs, load_metrics=get_all_metrics):
+    import numpy as np
+    import seaborn
     # based on the number of inputs and target
     # load stats from two directories
     if configs.target == "retransmits":
         assert len(configs.input) == 1
-        stats1 = get_all_metrics(configs.input[0])
+        stats1 = load_metrics(configs.input[0])
         stats2 = None
     else:
         assert len(configs.input) == 2
-        stats1 = get_all_metrics(configs.input[0])
-        stats2 = get_all_metrics(configs.input[1])
+        stats1 = load_metrics(configs.input[0])
+        stats2 = load_metrics(configs.input[1])
     # make sure we have the same stuff
     assert len(stats1) > 0
     if stats2 is not None:
@@ -126,17 +166,28 @@ def plot_heatmap(configs):
         mat2 = None
 
     if configs.target == "retransmits":
-        mat = np.array(mat1, dtype=int)
-    elif configs.target == "rtt":
-        mat = np.array(compute_dec(mat1, mat2) * 100, dtype=int)
+        mat = mat1
+    elif configs.target in latency_targets:
+        mat = compute_dec(mat1, mat2) * 100
+    elif configs.target in fct_targets:
+        # how many times longer the flows of the first input take
+        mat = mat1 / mat2
     else:
         assert configs.target == "goodput"
-        mat = np.array(compute_gain(mat1, mat2) * 100, dtype=int)
+        mat = compute_gain(mat1, mat2) * 100
+    if configs.target in fct_targets:
+        fmt = ".2f"
+    elif configs.allow_missing:
+        # missing cells stay NaN, which seaborn leaves blank
+        mat = np.trunc(mat)
+        fmt = ".0f"
+    else:
+        mat = np.array(mat, dtype=int)
+        fmt = "d"
     # prepare panda dataframe
 
-    df = get_heatmap_dataframe(mat, x_values, y_values, [configs.y, configs.x, "value"])
-    df = df.pivot(configs.x, configs.y, "value")
-    ax = seaborn.heatmap(df, annot=configs.target != "retransmits", fmt="d", cmap=seaborn.cm.rocket_r)
+    df = get_heatmap_dataframe(mat, x_values, y_values, configs.x, configs.y)
+    ax = seaborn.heatmap(df, annot=configs.target != "retransmits", fmt=fmt, cmap=seaborn.cm.rocket_r)
     ax.invert_yaxis()
     # set labels if necessary
     if configs.x == "rtt":
@@ -148,58 +199,42 @@ def plot_heatmap(configs):
 
 
 def preprocess_line_data(configs, stats):
+    import numpy as np
     # based on the names, figure out which two variables to use
-    params = [(parse_name_config(name), name) for name in stats]
-    param_values = get_param_values(params, {configs.x})
-
-    x_values = list(param_values[configs.x])
-    x_values.sort()
-
-    mat = np.zeros(shape=len(x_values), dtype=np.float64)
-    for x, x_value in enumerate(x_values):
-        # find the value
-        met = None
-        for param, name in params:
-            if getattr(param, configs.x) == x_value:
-                # found it
-                met = stats[name]
-        assert met is not None, "Unable to construct matrix"
-        if configs.y == "goodput":
-            mat[x] = met[0]
-        elif configs.y == "rtt":
-            mat[x] = met[1]
-        elif configs.y == "retransmits":
-            mat[x] = met[2]
-    return mat, x_values, params
+    table = get_metrics_table(stats)
+    check_param_values(table, {configs.x})
+
+    x_values = sorted(table[configs.x].unique().tolist())
+    # the median of the repetitions
+    values = table.groupby(configs.x)[target_columns[configs.y]].median()
+    mat = values.reindex(x_values).to_numpy(dtype=np.float64)
+    return mat, x_values, table
 
 
 def get_line_dataframe(configs, data, x_values, names):
-    result = []
+    import numpy as np
+    import pandas as pd
     data = np.array(data)
-    for y in range(len(x_values)):
-        for i in range(len(names)):
-            row = [x_values[y], names[i], data[i][y]]
-            result.append(row)
-
+    df = pd.DataFrame(data.T, columns=names)
     # whether we have total or not
     if configs.add_total:
         # need to add extra entries for Total
-        for y in range(len(x_values)):
-            row = [x_values[y], "Total", np.sum(data[:, y])]
-            result.append(row)
-    df = pd.DataFrame(result, columns=[configs.x, "name", configs.y])
+        df["Total"] = np.sum(data, axis=0)
+    df[configs.x] = x_values
+    df = df.melt(id_vars=configs.x, var_name="name", value_name=configs.y)
     return df
 
 
-def plot_line(configs):
+def plot_line(configs, load_metrics=get_all_metrics):
+    import seaborn
     raw_stats = []
     if not configs.split_host:
         assert len(configs.names) == len(configs.input)
         for dirname in configs.input:
-            raw_stats.append(get_all_metrics(dirname))
+            raw_stats.append(load_metrics(dirname))
     else:
         assert len(configs.input) == 1
-        raw_stats = get_all_metrics(configs.input[0], True)
+        raw_stats = load_metrics(configs.input[0], True)
         assert len(configs.names) == len(raw_stats)
     # check the stats data
     for stat in raw_stats:
@@ -229,10 +264,8 @@ def plot_line(configs):
 
     if configs.x == "loss":
         ax.set_xlabel("Loss Percentage (%)")
-    if configs.y == "goodput":
-        ax.set_ylabel("Goodput (Mbps)")
-    if configs.y == "retransmits":
-        ax.set_ylabel("Retr Number")
+    if configs.y in target_labels:
+        ax.set_ylabel(target_labels[configs.y])
     if configs.logx:
         ax.set_xscale("log")
 
@@ -247,13 +280,152 @@ def plot_line(configs):
     return ax
 
 
-def main():
+def preprocess_cdf_data(configs, stats):
+    import pandas as pd
+    # one value per h1 result, over all the configs and repetitions
+    table = get_metrics_table(stats)
+    table.index = pd.Index(list(stats), name="name")
+    table = table[table["hostname"] == "h1"]
+    column = target_columns[configs.target]
+    assert table[column].notna().any(), f"No {column} in the results"
+    return table[column].dropna()
+
+
+def plot_cdf(configs, load_metrics=get_all_metrics):
+    import pandas as pd
+    import seaborn
+    assert len(configs.names) == len(configs.input)
+    values = [preprocess_cdf_data(configs, load_metrics(dirname)) for dirname in configs.input]
+    if configs.ratio:
+        assert len(values) == 2, "--ratio needs two inputs"
+        # results of the same config and repetition have the same name
+        names = values[0].index.intersection(values[1].index)
+        assert len(names) > 0, "The inputs have no results in common"
+        df = pd.DataFrame({configs.target: values[0][names] / values[1][names],
+                           "name": f"{configs.names[0]} / {configs.names[1]}"})
+    else:
+        df = pd.concat([pd.DataFrame({configs.target: v, "name": name}) for v, name in zip(values, configs.names)])
+    ax = seaborn.ecdfplot(data=df, x=configs.target, hue="name")
+    label = target_labels.get(configs.target, configs.target)
+    ax.set_xlabel(f"{label} ratio" if configs.ratio else label)
+    ax.set_ylabel("CDF")
+    ax.get_legend().set_title(None)
+    return ax
+
+
+def render_figure(configs, metrics):
+    # runs in a worker process. metrics holds the preloaded results of every input directory
+    import matplotlib
     matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    def load_metrics(dirname, split_host=False):
+        return split_metrics_by_host(metrics[dirname]) if split_host else metrics[dirname]
+
+    fig = plt.figure()
+    try:
+        if configs.command == "heatmap":
+            plot_heatmap(configs, load_metrics)
+        elif configs.command == "cdf":
+            plot_cdf(configs, load_metrics)
+        else:
+            plot_line(configs, load_metrics)
+        fig.savefig(configs.out)
+    finally:
+        plt.close(fig)
+    return configs.out
+
+
+def get_figure_configs(figure, root):
+    configs = argparse.Namespace(**{**figure_defaults, **figure})
+    assert configs.command in commands, f"Unknown figure type {configs.command}"
+    configs.input = [os.path.join(root, dirname) for dirname in configs.input]
+    configs.out = os.path.join(root, configs.out)
+    return configs
+
+
+def get_figure_fingerprint(figure, input_fingerprints):
+    h = hashlib.sha1(json.dumps(figure, sort_keys=True).encode())
+    for fingerprint in input_fingerprints:
+        h.update(fingerprint.encode())
+    return h.hexdigest()
+
+
+def plot_batch(configs):
+    import concurrent.futures
+    import resultdb
+    with open(configs.manifest) as f:
+        figures = json.load(f)["figures"]
+    figure_configs = [get_figure_configs(figure, configs.root) for figure in figures]
+
+    # load every input directory once and keep track of what each figure depends on
+    conn = resultdb.connect()
+    metrics = {}
+    input_fingerprints = {}
+    # inputs that couldn't be loaded, e.g. results that were never run. only their figures are left out
+    load_errors = {}
+    for figure in figure_configs:
+        for dirname in figure.input:
+            if dirname not in metrics and dirname not in load_errors:
+                try:
+                    metrics[dirname] = get_all_metrics(dirname)
+                    input_fingerprints[dirname] = resultdb.get_fingerprint(dirname, conn)
+                except (OSError, ValueError) as ex:
+                    metrics.pop(dirname, None)
+                    load_errors[dirname] = ex
+
+    state_filename = os.path.join(configs.root, ".plot_batch_state.json")
+    state = {}
+    if os.path.exists(state_filename) and not configs.force:
+        with open(state_filename) as f:
+            state = json.load(f)
+
+    futures = {}
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=configs.jobs) as pool:
+        for figure, figure_config in zip(figures, figure_configs):
+            missing = [dirname for dirname in figure_config.input if dirname in load_errors]
+            if missing:
+                failed += 1
+                print(f"Unable to render {figure_config.out}: unable to load {missing[0]}: {load_errors[missing[0]]!r}",
+                      file=sys.stderr)
+                continue
+            fingerprint = get_figure_fingerprint(figure, [input_fingerprints[d] for d in figure_config.input])
+            if state.get(figure_config.out) == fingerprint and os.path.exists(figure_config.out):
+                print("Skipping", figure_config.out)
+                continue
+            figure_metrics = {dirname: metrics[dirname] for dirname in figure_config.input}
+            future = pool.submit(render_figure, figure_config, figure_metrics)
+            futures[future] = (figure_config.out, fingerprint)
+
+        for future in concurrent.futures.as_completed(futures):
+            out, fingerprint = futures[future]
+            try:
+                future.result()
+                state[out] = fingerprint
+                print("Rendered", out)
+            except Exception as ex:
+                failed += 1
+                print(f"Unable to render {out}: {ex!r}", file=sys.stderr)
+
+    with open(state_filename, "w+") as f:
+        json.dump(state, f, indent=2)
+    return failed
+
+
+def main():
     configs = get_configs()
+    if configs.command == "batch":
+        failed = plot_batch(configs)
+        sys.exit(1 if failed else 0)
+    import matplotlib
+    matplotlib.use('Agg')
     if configs.command == "heatmap":
         ax = plot_heatmap(configs)
     elif configs.command == "line":
         ax = plot_line(configs)
+    elif configs.command == "cdf":
+        ax = plot_cdf(configs)
     else:
         ax = None
     # save figure
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# samples the statistics of the root qdisc of the bottleneck interface through rtnetlink, the same numbers that
+# tc -s qdisc prints. each sample is a fixed-width record, so that a run can be loaded as one NumPy array.
+# this file is copied to the LAN switch, so it only uses the standard library outside of the loader
+# usage:
+#   qdisc.py record -d <interface> -o <file or - for stdout> [-i <interval in ms>]   runs until SIGINT/SIGTERM
+#   qdisc.py dump <file>
+
+import argparse
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+
+# header: magic, record size, interval in us
+MAGIC = b"QDISC001"
+HEADER = struct.Struct("<8sII")
+# time, qlen, backlog, drops, requeues, overlimits, bytes, packets. time is the unix time in seconds, backlog is in
+# bytes, and the rest are the counters of struct gnet_stats_queue and gnet_stats_basic
+RECORD = struct.Struct("<dIIIIIQI")
+record_fields = [("time", "<f8"), ("qlen", "<u4"), ("backlog", "<u4"), ("drops", "<u4"), ("requeues", "<u4"),
+                 ("overlimits", "<u4"), ("bytes", "<u8"), ("packets", "<u4")]
+
+RTM_NEWQDISC = 36
+RTM_GETQDISC = 38
+NLM_F_REQUEST = 0x1
+NLM_F_ECHO = 0x8
+NLMSG_ERROR = 2
+TC_H_ROOT = 0xFFFFFFFF
+TCA_STATS2 = 7
+TCA_STATS_BASIC = 1
+TCA_STATS_QUEUE = 3
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+# family, pad, ifindex, handle, parent, info
+TCMSG = struct.Struct("=BxxxiIII")
+RTATTR = struct.Struct("=HH")
+NLMSG_ERROR_CODE = struct.Struct("=i")
+GNET_STATS_BASIC = struct.Struct("=QI")
+GNET_STATS_QUEUE = struct.Struct("=IIIII")
+
+
+def get_queue_filename(result_filename):
+    # next to the iperf3 JSON. the result loaders only read *.json
+    return os.path.splitext(result_filename)[0] + ".qdisc"
+
+
+def get_sampler_commands(dev, filename, interval, python=sys.executable, path=os.path.abspath(__file__)):
+    return [python, path, "record", "-d", dev, "-o", filename, "-i", str(interval)]
+
+
+def get_attrs(data, offset):
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        length, attr_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + RTATTR.size:offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+class Sampler:
+    def __init__(self, dev):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.buffer = bytearray(1 << 16)
+        # ask for the root qdisc only. it accounts for the packets held by its children, e.g. netem under tbf.
+        # without NLM_F_ECHO the kernel only multicasts the answer to the tc group
+        body = TCMSG.pack(socket.AF_UNSPEC, socket.if_nametoindex(dev), 0, TC_H_ROOT, 0)
+        self.request = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(body), RTM_GETQDISC, NLM_F_REQUEST | NLM_F_ECHO,
+                                         1, 0) + body
+
+    def sample(self):
+        """Returns (qlen, backlog, drops, requeues, overlimits, bytes, packets) of the root qdisc"""
+        self.sock.send(self.request)
+        size = self.sock.recv_into(self.buffer)
+        data = memoryview(self.buffer)[:size]
+        length, msg_type, _, __, ___ = NLMSG_HEADER.unpack_from(data)
+        if msg_type == NLMSG_ERROR:
+            error = NLMSG_ERROR_CODE.unpack_from(data, NLMSG_HEADER.size)[0]
+            raise OSError(-error, os.strerror(-error))
+        assert msg_type == RTM_NEWQDISC, f"unexpected netlink message {msg_type}"
+        attrs = get_attrs(data[:length], NLMSG_HEADER.size + TCMSG.size)
+        stats = get_attrs(attrs[TCA_STATS2], 0)
+        num_bytes, packets = GNET_STATS_BASIC.unpack_from(stats[TCA_STATS_BASIC])
+        return GNET_STATS_QUEUE.unpack_from(stats[TCA_STATS_QUEUE]) + (num_bytes, packets)
+
+
+def record(dev, filename, interval):
+    sampler = Sampler(dev)
+    stopped = False
+
+    def stop(signum, frame):
+        nonlocal stopped
+        stopped = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    period = interval / 1000
+    # on the LAN switch, the samples are streamed back over ssh. flush every sample, since the sampler is stopped
+    # by closing the connection
+    streaming = filename == "-"
+    f = sys.stdout.buffer if streaming else open(filename, "wb")
+    try:
+        f.write(HEADER.pack(MAGIC, RECORD.size, int(interval * 1000)))
+        next_time = time.monotonic()
+        while not stopped:
+            f.write(RECORD.pack(time.time(), *sampler.sample()))
+            if streaming:
+                f.flush()
+            # sample on a fixed grid, without drifting by the time a sample takes
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()
+    except BrokenPipeError:
+        # the other end of the ssh connection is gone
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if not streaming:
+            f.close()
+
+
+def load_queue(filename, start_time=0):
+    """Load the samples as a NumPy record array with the fields of record_fields. start_time, e.g. the iperf3
+    start timestamp, is subtracted from the sample times"""
+    import numpy as np
+    with open(filename, "rb") as f:
+        magic, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+    assert magic == MAGIC, f"{filename} is not a qdisc file"
+    assert record_size == RECORD.size, f"{filename} has an unsupported record size {record_size}"
+    samples = np.fromfile(filename, dtype=np.dtype(record_fields), offset=HEADER.size).view(np.recarray)
+    samples.time -= start_time
+    return samples
+
+
+def get_queue_summary(filename, bw, rtt, start_time=0, end_time=None):
+    """Queue delay percentiles in ms, and drops, of the samples between start_time and end_time. The delay is the
+    backlog drained at the bottleneck rate bw in Mbps. netem also holds the packets for its one-way delay, half of
+    the rtt in ms, which are a full bandwidth delay product when the link is busy. That part is subtracted"""
+    import numpy as np
+    samples = load_queue(filename)
+    mask = samples.time >= start_time
+    if end_time is not None:
+        mask &= samples.time <= end_time
+    samples = samples[mask]
+    if len(samples) == 0:
+        return {}
+    delay = samples.backlog.astype(np.float64) * 8 / (bw * 1000) - rtt / 2
+    delay = np.maximum(delay, 0)
+    p50, p95, p99 = np.percentile(delay, [50, 95, 99])
+    return {"queue_delay_p50": float(p50), "queue_delay_p95": float(p95), "queue_delay_p99": float(p99),
+            "queue_delay_max": float(delay.max()), "queue_drops": int(samples.drops[-1] - samples.drops[0]),
+            "queue_samples": len(samples)}
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Sample the bottleneck queue")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p = subparsers.add_parser("record")
+    p.add_argument("-d", "--dev", required=True, type=str, dest="dev", help="Bottleneck interface")
+    p.add_argument("-o", "--output", required=True, type=str, dest="output", help="Output file, - for stdout")
+    p.add_argument("-i", "--interval", default=1, type=float, dest="interval", help="Sampling interval in ms")
+    p = subparsers.add_parser("dump")
+    p.add_argument("input", type=str, help="qdisc file")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.command == "record":
+        record(args.dev, args.output, args.interval)
+    else:
+        samples = load_queue(args.input)
+        print(" ".join(name for name, _ in record_fields))
+        for sample in samples:
+            print(" ".join(str(v) for v in sample))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# SQLite index of iperf3 results. Each file is parsed once and only parsed again when its mtime or size changes,
+# or when its .tcpinfo sidecar (which the latency metrics are read from) appears, changes or disappears
+# usage: resultdb.py <result directory> [<result directory> ...]
+
+import hashlib
+import os
+import sqlite3
+import sys
+
+from util import load_iperf_end, load_iperf_start, get_end_metrics, get_latency_metrics, get_fct_metrics, \
+    parse_name_config, config_param_names, latency_metric_names, fct_metric_names, parallel_map
+
+# bump this whenever the table layout changes. the index is rebuilt from the result files
+SCHEMA_VERSION = 4
+
+result_columns = ["path", "dirname", "name"] + config_param_names + \
+                 ["cc", "goodput", "mean_rtt", "retransmits"] + latency_metric_names + fct_metric_names + \
+                 ["mtime", "size", "tcpinfo_mtime", "tcpinfo_size"]
+
+
+def get_index_filename():
+    filename = os.environ.get("BBR_RESULTS_INDEX", "")
+    if filename:
+        return filename
+    cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_dir, "when-to-use-bbr", "results.sqlite")
+
+
+def connect(filename=None):
+    filename = filename or get_index_filename()
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    conn = sqlite3.connect(filename, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # plot workers read the index while another process may be ingesting
+    conn.execute("PRAGMA journal_mode=WAL")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        conn.execute("DROP TABLE IF EXISTS results")
+        conn.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+    conn.execute("CREATE TABLE IF NOT EXISTS results (path TEXT PRIMARY KEY, dirname TEXT NOT NULL, name TEXT NOT NULL, "
+                 "hostname TEXT, buffer_size REAL, rtt INTEGER, bw INTEGER, loss REAL, repetition INTEGER, cc TEXT, "
+                 "goodput REAL, mean_rtt REAL, retransmits INTEGER, min_rtt REAL, max_rtt REAL, rtt_p50 REAL, "
+                 "rtt_p95 REAL, rtt_p99 REAL, fct REAL, slowdown REAL, mtime REAL NOT NULL, size INTEGER NOT NULL, "
+                 "tcpinfo_mtime REAL, tcpinfo_size INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS results_dirname ON results (dirname)")
+    conn.commit()
+    return conn
+
+
+def parse_result(entry):
+    path, dirname, mtime, size, tcpinfo_mtime, tcpinfo_size = entry
+    name = os.path.splitext(os.path.basename(path))[0]
+    end = load_iperf_end(path)
+    goodput, mean_rtt, retransmits = get_end_metrics(end, path)
+    try:
+        config = parse_name_config(name)
+    except (AssertionError, IndexError, ValueError):
+        # not named by get_filename, still index the metrics
+        config = None
+    row = {"path": path, "dirname": dirname, "name": name, "cc": end.get("sender_tcp_congestion"),
+           "goodput": goodput, "mean_rtt": mean_rtt, "retransmits": retransmits, "mtime": mtime, "size": size,
+           "tcpinfo_mtime": tcpinfo_mtime, "tcpinfo_size": tcpinfo_size}
+    row.update(zip(latency_metric_names, get_latency_metrics(end, path)))
+    row.update(zip(fct_metric_names, get_fct_metrics(load_iperf_start(path), end, config)))
+    if config is None:
+        row.update({param_name: None for param_name in config_param_names})
+    else:
+        row.update(config._asdict())
+    return row
+
+
+def ingest(dirname, conn=None):
+    """Bring the index up to date with the JSON files in dirname. Returns the number of files (re-)parsed"""
+    conn = conn or connect()
+    dirname = os.path.abspath(dirname)
+    indexed = {row["path"]: (row["mtime"], row["size"], row["tcpinfo_mtime"], row["tcpinfo_size"])
+               for row in conn.execute("SELECT path, mtime, size, tcpinfo_mtime, tcpinfo_size FROM results "
+                                       "WHERE dirname = ?", (dirname,))}
+    results = {}
+    sidecars = {}
+    with os.scandir(dirname) as it:
+        for entry in it:
+            if entry.name.endswith(".json") and entry.is_file():
+                st = entry.stat()
+                results[entry.path] = (st.st_mtime, st.st_size)
+            elif entry.name.endswith(".tcpinfo") and entry.is_file():
+                st = entry.stat()
+                sidecars[os.path.splitext(entry.path)[0]] = (st.st_mtime, st.st_size)
+    changed = []
+    for path, stat in results.items():
+        key = stat + sidecars.get(os.path.splitext(path)[0], (None, None))
+        if indexed.get(path) != key:
+            changed.append((path, dirname) + key)
+
+    rows = parallel_map(parse_result, changed)
+    removed = [(path,) for path in indexed if path not in results]
+    if rows or removed:
+        with conn:
+            conn.executemany("DELETE FROM results WHERE path = ?", removed)
+            conn.executemany("INSERT OR REPLACE INTO results ({0}) VALUES ({1})".format(
+                ", ".join(result_columns), ", ".join(":" + c for c in result_columns)), rows)
+    return len(rows)
+
+
+def get_results(dirname, conn=None):
+    """Rows of all results in dirname, ingesting changed files first"""
+    conn = conn or connect()
+    ingest(dirname, conn)
+    dirname = os.path.abspath(dirname)
+    return conn.execute("SELECT * FROM results WHERE dirname = ? ORDER BY name", (dirname,)).fetchall()
+
+
+def get_fingerprint(dirname, conn=None):
+    """Hash of the path, mtime and size of every result and its sidecar in dirname. Changes whenever either does"""
+    h = hashlib.sha1()
+    for row in get_results(dirname, conn):
+        h.update(f"{row['path']}:{row['mtime']}:{row['size']}:{row['tcpinfo_mtime']}:{row['tcpinfo_size']}\n".encode())
+    return h.hexdigest()
+
+
+def __main():
+    conn = connect()
+    for dirname in sys.argv[1:]:
+        count = ingest(dirname, conn)
+        print(f"{dirname}: {count} updated")
+
+
+if __name__ == "__main__":
+    __main()
@@ -4,5 +4,5 @@ sudo sysctl -w net.ipv4.tcp_no_metrics_save=1
 sudo sysctl -w net.ipv4.route.flush=1
 sudo modprobe tcp_bbr
 ./build_pcc.sh
-sudo python3 build_bbr.py -g 3 2 -o bbr_3_2 --install
-sudo python3 build_bbr.py -g 11 10 -o bbr_11_10 --install
+# builds both in parallel into bbr_3_2 and bbr_11_10, or takes them from the build cache
+sudo python3 build_bbr.py -g 3 2 -g 11 10 -o . --install
@@ -0,0 +1,91 @@
+# multiplexed ssh connections. every (user, host, port, key) gets one master connection, and all the ssh calls of
+# a sweep go through it, including the ones made by different bbr.py processes. this saves the handshake on every
+# call and keeps sweeps from running into sshd's MaxStartups throttling
+
+import os
+import subprocess
+
+import tracing
+
+# how long an idle master connection stays alive, in seconds
+CONTROL_PERSIST = 600
+# the scripts copied to the remote machines, some of which run under sudo, and the socket of the agent. unlike /tmp,
+# only the remote user can write to this directory. ~ is expanded by the remote shell
+REMOTE_DIR = "~/.when-to-use-bbr"
+REMOTE_AGENT_PATH = f"{REMOTE_DIR}/agent.py"
+REMOTE_AGENT_SOCKET = f"{REMOTE_DIR}/agent.sock"
+REMOTE_SAMPLER_PATH = f"{REMOTE_DIR}/qdisc.py"
+REMOTE_WORKER_PATH = f"{REMOTE_DIR}/worker.py"
+
+
+def get_control_dir():
+    # bbr.py runs under sudo, so use the invoking user's directory to share the masters with the run script
+    uid = os.environ.get("SUDO_UID", str(os.getuid()))
+    return os.path.join("/tmp", f"bbr-ssh-{uid}")
+
+
+def get_ssh_options():
+    control_dir = get_control_dir()
+    if not os.path.exists(control_dir):
+        os.makedirs(control_dir, mode=0o700, exist_ok=True)
+    # %C is a hash of the local host, remote host, port and user, which keeps the socket path short
+    return ["-o", "ControlMaster=auto", "-o", f"ControlPath={os.path.join(control_dir, '%C')}",
+            "-o", f"ControlPersist={CONTROL_PERSIST}"]
+
+
+def get_remote_username(host):
+    # machines outside of the LAN subnet (10.x.x.x) are EC2 instances
+    if host.split(".")[0] != "10":
+        return "ubuntu"
+    else:
+        return "mininet"
+
+
+def get_ssh_destination(host, port=22, username="mininet", id_file=""):
+    commands = [f"{username}@{host}", "-p", f"{port}"]
+    if len(id_file) > 0:
+        commands += ["-i", id_file]
+    return commands
+
+
+def get_ssh_commands(host, commands, port=22, debug=False, username="mininet", id_file=""):
+    ssh_commands = ["ssh"] + get_ssh_options() + get_ssh_destination(host, port, username, id_file)
+    commands = ssh_commands + commands
+    if debug:
+        print("SSH cmd:", " ".join(commands))
+    return commands
+
+
+class SSHPool:
+    """Keeps one master connection open per (user, host, port, key) until the pool is closed"""
+    def __init__(self, debug=False):
+        self.__debug = debug
+        self.__masters = set()
+
+    def open(self, host, port=22, username="mininet", id_file=""):
+        key = (username, host, port, id_file)
+        if key in self.__masters:
+            return
+        destination = get_ssh_destination(host, port, username, id_file)
+        check = ["ssh"] + get_ssh_options() + ["-O", "check"] + destination
+        with tracing.span(f"ssh master {host}", "ssh"):
+            if subprocess.call(check, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) != 0:
+                # -f puts the master in the background once it is authenticated
+                commands = ["ssh"] + get_ssh_options() + ["-M", "-N", "-f"] + destination
+                if self.__debug:
+                    print("SSH master:", " ".join(commands))
+                subprocess.check_call(commands)
+        self.__masters.add(key)
+
+    def close(self):
+        for username, host, port, id_file in self.__masters:
+            destination = get_ssh_destination(host, port, username, id_file)
+            subprocess.call(["ssh"] + get_ssh_options() + ["-O", "exit"] + destination,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.__masters.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# checks the startup time of the entry points against a budget, and that heavy modules are only
+# imported by the code paths that need them. run by the CI
+# usage: startup.py [-n <repeats>]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# entry point and its budget in ms, on top of starting a bare interpreter
+entry_points = [
+    (["bbr.py", "--help"], 100),
+    (["run", "mininet", "--help"], 100),
+    (["plot.py", "heatmap", "--help"], 100),
+    (["plot.py", "batch", "--help"], 100),
+]
+
+# modules that importing each module must not pull in
+import_budgets = [
+    ("bbr", ["mininet", "numpy", "pandas"]),
+    ("plot", ["numpy", "pandas", "seaborn", "matplotlib"]),
+    ("util", ["numpy", "pandas", "sqlite3"]),
+    ("sweep", ["mininet", "numpy", "pandas"]),
+    ("build_bbr", ["urllib.request"]),
+]
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Check entry point startup time")
+    parser.add_argument("-n", "--repeat", default=10, type=int, dest="repeat", help="Number of runs to take the "
+                                                                                     "median of")
+    return parser.parse_args()
+
+
+def measure(commands, repeat):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + commands, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def check_imports(module, forbidden):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=cwd, text=True)
+    loaded = set(output.split())
+    return [name for name in forbidden if name in loaded]
+
+
+def main():
+    args = get_args()
+    failed = False
+    baseline = measure(["-c", "pass"], args.repeat)
+    print(f"interpreter: {baseline:.1f} ms")
+    for commands, budget in entry_points:
+        elapsed = measure(commands, args.repeat) - baseline
+        status = "ok" if elapsed <= budget else "OVER BUDGET"
+        failed = failed or elapsed > budget
+        print(f"{' '.join(commands)}: {elapsed:.1f} ms (budget {budget} ms) {status}")
+    for module, forbidden in import_budgets:
+        loaded = check_imports(module, forbidden)
+        if loaded:
+            failed = True
+            print(f"import {module}: loads {', '.join(loaded)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# helper functions to execute a sweep of experiments
+
+import json
+import subprocess
+import sys
+import threading
+
+import tracing
+from util import DEFAULT_PORT, MAX_SENDERS
+
+# each job slot gets its own block of iperf3 ports
+PORT_STRIDE = MAX_SENDERS
+# printed by a bbr.py --session process on a line of its own after every experiment
+SESSION_DONE = "session: done"
+
+
+def get_job_port(slot):
+    return DEFAULT_PORT + slot * PORT_STRIDE
+
+
+class BandwidthAdmission:
+    """Hands out job slots while the total bottleneck bandwidth of the running jobs stays within the budget.
+    Emulating a link costs CPU in proportion to its bandwidth, so admitting by bandwidth keeps concurrent jobs
+    from competing for CPU in a way that changes the results."""
+    def __init__(self, jobs, bw_budget):
+        self.__cond = threading.Condition()
+        self.__jobs = jobs
+        self.__free_slots = list(range(jobs))
+        self.__bw_budget = bw_budget
+        self.__bw_used = 0
+
+    def __can_admit(self, bw):
+        if len(self.__free_slots) == 0:
+            return False
+        if len(self.__free_slots) == self.__jobs:
+            # nothing is running. a job that exceeds the budget on its own still has to run
+            return True
+        return self.__bw_used + bw <= self.__bw_budget
+
+    def acquire(self, bw):
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__can_admit(bw))
+            self.__bw_used += bw
+            return self.__free_slots.pop(0)
+
+    def release(self, slot, bw):
+        with self.__cond:
+            self.__bw_used -= bw
+            self.__free_slots.append(slot)
+            self.__free_slots.sort()
+            self.__cond.notify_all()
+
+
+def run_parallel(tasks, jobs, bw_budget, debug=False, progress=None):
+    """Run (bw, commands) tasks with up to `jobs` of them at once. Each task gets the job slot and iperf3 port
+    appended to its command, and tasks are admitted in order. After the first failure no more tasks are started
+    and the error is raised once the running ones finish. progress is told about every finished task by index"""
+    admission = BandwidthAdmission(jobs, bw_budget)
+    errors = []
+
+    def run_job(index, slot, bw, commands):
+        try:
+            with tracing.span(f"job {slot}", "process", commands=" ".join(commands)):
+                subprocess.check_call(commands, stderr=sys.stderr)
+            if progress is not None:
+                progress.finish(index)
+        except subprocess.CalledProcessError as ex:
+            errors.append(ex)
+        finally:
+            admission.release(slot, bw)
+
+    threads = []
+    for index, (bw, commands) in enumerate(tasks):
+        slot = admission.acquire(bw)
+        if errors:
+            admission.release(slot, bw)
+            break
+        commands = commands + ["--job-id", str(slot), "--port", str(get_job_port(slot))]
+        if debug:
+            print(f"[job {slot}]", *commands)
+        t = threading.Thread(target=run_job, args=(index, slot, bw, commands))
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+
+def write_lines(f, lines):
+    try:
+        for line in lines:
+            f.write(line + "\n")
+        f.close()
+    except BrokenPipeError:
+        # the session exited early, which its return code reports
+        pass
+
+
+def run_session(commands, params, debug=False, progress=None):
+    """Run all experiments in a single bbr.py --session process, which keeps the topology alive and reads
+    one JSON object of experiment parameters per line. progress is told about every finished experiment by index"""
+    commands = commands + ["--session"]
+    if debug:
+        print(*commands)
+    lines = [json.dumps(p) for p in params]
+    with tracing.span("session", "process", commands=" ".join(commands)):
+        p = subprocess.Popen(commands, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, stderr=sys.stderr)
+        # the session prints while it reads the parameters, so they are written from a thread
+        writer = threading.Thread(target=write_lines, args=(p.stdin, lines))
+        writer.start()
+        done = 0
+        for line in p.stdout:
+            if line.rstrip("\n") != SESSION_DONE:
+                sys.stdout.write(line)
+                continue
+            if progress is not None:
+                progress.finish(done)
+            done += 1
+        writer.join()
+        if p.wait() != 0:
+            raise subprocess.CalledProcessError(p.returncode, commands)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# samples the kernel TCP_INFO of the iperf3 flows through netlink sock_diag, the same interface ss uses.
+# each sample is a fixed-width record, so that a run can be loaded as one NumPy array
+# usage:
+#   tcpinfo.py record -p <iperf3 server port> -o <file> [-i <interval in ms>]   runs until SIGINT/SIGTERM
+#   tcpinfo.py dump <file>
+
+import argparse
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+
+# header: magic, record size, interval in us
+MAGIC = b"TCPINFO1"
+HEADER = struct.Struct("<8sII")
+# time, source port, destination port, snd_cwnd, rtt, rttvar, min_rtt, total_retrans, pacing_rate, delivery_rate,
+# bytes_acked. time is the unix time in seconds, RTTs are in us and rates in bytes/s, like in struct tcp_info
+RECORD = struct.Struct("<dHHIIIIIQQQ")
+record_fields = [("time", "<f8"), ("sport", "<u2"), ("dport", "<u2"), ("cwnd", "<u4"), ("srtt", "<u4"),
+                 ("rttvar", "<u4"), ("min_rtt", "<u4"), ("retrans", "<u4"), ("pacing_rate", "<u8"),
+                 ("delivery_rate", "<u8"), ("bytes_acked", "<u8")]
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+TCP_ESTABLISHED = 1
+
+NLMSG_HEADER = struct.Struct("=IHHII")
+# family, protocol, extensions, pad, states, then an all zero inet_diag_sockid
+INET_DIAG_REQ = struct.Struct("=BBBxI48x")
+# sport and dport of inet_diag_sockid are big endian, right after family, state, timer and retrans
+INET_DIAG_PORTS = struct.Struct("!HH")
+INET_DIAG_MSG_SIZE = 72
+RTATTR = struct.Struct("=HH")
+# struct tcp_info (include/uapi/linux/tcp.h): tcpi_rtt at 68, tcpi_rttvar, tcpi_snd_cwnd at 80, tcpi_total_retrans at
+# 100, tcpi_pacing_rate, tcpi_bytes_acked at 120, tcpi_min_rtt at 148 and tcpi_delivery_rate at 160
+TCP_INFO = struct.Struct("=68xII4xI16xIQ8xQ20xI")
+TCP_INFO_DELIVERY_RATE = struct.Struct("=160xQ")
+
+
+def get_tcpinfo_filename(result_filename):
+    # next to the iperf3 JSON. the result loaders only read *.json
+    return os.path.splitext(result_filename)[0] + ".tcpinfo"
+
+
+def get_sampler_commands(port, filename, interval):
+    tcpinfo = os.path.abspath(__file__)
+    return [sys.executable, tcpinfo, "record", "-p", str(port), "-o", filename, "-i", str(interval)]
+
+
+def parse_tcp_info(data):
+    # older kernels have a shorter struct tcp_info
+    if len(data) < TCP_INFO.size:
+        return None
+    srtt, rttvar, cwnd, retrans, pacing_rate, bytes_acked, min_rtt = TCP_INFO.unpack_from(data)
+    delivery_rate = TCP_INFO_DELIVERY_RATE.unpack_from(data)[0] if len(data) >= TCP_INFO_DELIVERY_RATE.size else 0
+    return cwnd, srtt, rttvar, min_rtt, retrans, pacing_rate, delivery_rate, bytes_acked
+
+
+class Sampler:
+    def __init__(self, port):
+        self.port = port
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+        self.buffer = bytearray(1 << 16)
+        # the request never changes, only the sequence number would, and the kernel doesn't need it
+        body = INET_DIAG_REQ.pack(socket.AF_INET, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1),
+                                  1 << TCP_ESTABLISHED)
+        self.request = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(body), SOCK_DIAG_BY_FAMILY,
+                                         NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + body
+
+    def sample(self):
+        """Yields (sport, dport, tcp_info fields) of every established connection to the port"""
+        self.sock.send(self.request)
+        while True:
+            size = self.sock.recv_into(self.buffer)
+            data = memoryview(self.buffer)[:size]
+            offset = 0
+            while offset < size:
+                length, msg_type, _, __, ___ = NLMSG_HEADER.unpack_from(data, offset)
+                if msg_type == NLMSG_DONE:
+                    return
+                if msg_type == NLMSG_ERROR:
+                    raise OSError("sock_diag request failed")
+                msg = data[offset + NLMSG_HEADER.size:offset + length]
+                sport, dport = INET_DIAG_PORTS.unpack_from(msg, 4)
+                if dport == self.port:
+                    info = self.get_info(msg)
+                    if info is not None:
+                        yield (sport, dport) + info
+                # messages are aligned to 4 bytes
+                offset += (length + 3) & ~3
+
+    @staticmethod
+    def get_info(msg):
+        offset = INET_DIAG_MSG_SIZE
+        while offset + RTATTR.size <= len(msg):
+            length, attr_type = RTATTR.unpack_from(msg, offset)
+            if length < RTATTR.size:
+                break
+            if attr_type == INET_DIAG_INFO:
+                return parse_tcp_info(msg[offset + RTATTR.size:offset + length])
+            offset += (length + 3) & ~3
+        return None
+
+
+def record(port, filename, interval):
+    sampler = Sampler(port)
+    stopped = False
+
+    def stop(signum, frame):
+        nonlocal stopped
+        stopped = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    period = interval / 1000
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, RECORD.size, int(interval * 1000)))
+        next_time = time.monotonic()
+        while not stopped:
+            now = time.time()
+            for values in sampler.sample():
+                f.write(RECORD.pack(now, *values))
+            # sample on a fixed grid, without drifting by the time a sample takes
+            next_time += period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()
+
+
+def load_tcpinfo(filename, data_only=True):
+    """Load the samples as a NumPy record array with the fields of record_fields. iperf3 opens a control connection
+    to the same port, so by default only the connection that acked the most bytes is returned"""
+    import numpy as np
+    with open(filename, "rb") as f:
+        magic, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+    assert magic == MAGIC, f"{filename} is not a tcpinfo file"
+    assert record_size == RECORD.size, f"{filename} has an unsupported record size {record_size}"
+    samples = np.fromfile(filename, dtype=np.dtype(record_fields), offset=HEADER.size).view(np.recarray)
+    if data_only and len(samples) > 0:
+        sports = np.unique(samples.sport)
+        data_port = max(sports, key=lambda p: samples.bytes_acked[samples.sport == p].max())
+        samples = samples[samples.sport == data_port]
+    return samples
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Sample TCP_INFO of iperf3 flows")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p = subparsers.add_parser("record")
+    p.add_argument("-p", "--port", required=True, type=int, dest="port", help="iperf3 server port of the flow")
+    p.add_argument("-o", "--output", required=True, type=str, dest="output", help="Output file")
+    p.add_argument("-i", "--interval", default=10, type=float, dest="interval", help="Sampling interval in ms")
+    p = subparsers.add_parser("dump")
+    p.add_argument("input", type=str, help="tcpinfo file")
+    p.add_argument("--all", action="store_true", dest="all", help="Include the iperf3 control connection")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.command == "record":
+        record(args.port, args.output, args.interval)
+    else:
+        samples = load_tcpinfo(args.input, data_only=not args.all)
+        print(" ".join(name for name, _ in record_fields))
+        for sample in samples:
+            print(" ".join(str(v) for v in sample))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# lightweight tracing of the experiments. spans of the phases, subprocesses and ssh calls are kept in memory and
+# written as Chrome trace events, which chrome://tracing and ui.perfetto.dev open. tracing is off unless start() is
+# called, and everything else does nothing then. timestamps are wall clock, so that the traces of the experiments
+# of a sweep, which run in their own processes, line up when run merges them
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+# the merged trace of a sweep, in its output folder
+SWEEP_TRACE = "sweep.trace"
+
+
+def get_trace_filename(result_filename):
+    # next to the iperf3 JSON. the result loaders only read *.json
+    return os.path.splitext(result_filename)[0] + ".trace"
+
+
+def get_timestamp():
+    # in us
+    return time.time() * 1e6
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        # the ids of the open async spans, e.g. of processes by their pid
+        self.spans = {}
+        self.processes = {}
+        self.next_id = 0
+        # spans are added from the threads of parallel sweeps
+        self.lock = threading.Lock()
+
+    def add(self, event):
+        event["pid"] = os.getpid()
+        event["tid"] = threading.get_ident()
+        with self.lock:
+            self.events.append(event)
+
+    def begin(self, name, category, args):
+        with self.lock:
+            self.next_id += 1
+            span_id = f"{os.getpid()}-{self.next_id}"
+            self.spans[span_id] = (name, category)
+        self.add({"name": name, "cat": category, "ph": "b", "id": span_id, "ts": get_timestamp(), "args": args})
+        return span_id
+
+    def end(self, span_id, args):
+        with self.lock:
+            name, category = self.spans.pop(span_id)
+        self.add({"name": name, "cat": category, "ph": "e", "id": span_id, "ts": get_timestamp(), "args": args})
+
+
+_tracer = None
+
+
+def start():
+    global _tracer
+    _tracer = Tracer()
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def save(filename):
+    """Writes the trace and stops tracing"""
+    global _tracer
+    if _tracer is None:
+        return
+    events = _tracer.events
+    _tracer = None
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+@contextlib.contextmanager
+def span(name, category="phase", **args):
+    # spans on the same thread have to nest, e.g. the phases of an experiment
+    if _tracer is None:
+        yield
+        return
+    start_time = get_timestamp()
+    try:
+        yield
+    finally:
+        _tracer.add({"name": name, "cat": category, "ph": "X", "ts": start_time, "dur": get_timestamp() - start_time,
+                     "args": args})
+
+
+def begin(name, category, **args):
+    """Starts a span that may overlap with others, e.g. concurrent ssh calls. Returns the id to end it with"""
+    if _tracer is None:
+        return None
+    return _tracer.begin(name, category, args)
+
+
+def end(span_id, **args):
+    if _tracer is None or span_id is None:
+        return
+    _tracer.end(span_id, args)
+
+
+def get_process_category(commands):
+    return "ssh" if commands[0] == "ssh" else "process"
+
+
+def process_started(p, name, commands):
+    """Starts the span of a subprocess, which process_finished(p) ends"""
+    if _tracer is None:
+        return
+    span_id = _tracer.begin(name, get_process_category(commands), {"commands": " ".join(str(c) for c in commands)})
+    with _tracer.lock:
+        _tracer.processes[p.pid] = span_id
+
+
+def process_finished(p):
+    if _tracer is None:
+        return
+    with _tracer.lock:
+        span_id = _tracer.processes.pop(p.pid, None)
+    if span_id is not None:
+        _tracer.end(span_id, {"returncode": p.returncode})
+
+
+def save_merged(filename, traces):
+    """Writes the current trace together with the (name, filename) traces of the experiments, each shown as a
+    process of its own, and stops tracing"""
+    global _tracer
+    events = []
+    if _tracer is not None:
+        events += [{**event, "pid": 0} for event in _tracer.events]
+        events.append({"name": "process_name", "ph": "M", "pid": 0, "args": {"name": "run"}})
+        _tracer = None
+    for pid, (name, trace_filename) in enumerate(traces, 1):
+        with open(trace_filename) as f:
+            trace = json.load(f)
+        events += [{**event, "pid": pid} for event in trace["traceEvents"]]
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}})
+    with open(filename, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -3,14 +3,79 @@
 import json
 import sys
 import os
+import re
+import time
 import collections
 
+# iperf3 server port for h1. other senders use the following ports
+DEFAULT_PORT = 9998
+# each sender takes one port, so this also bounds the ports of a job
+MAX_SENDERS = 100
+# --adaptive reads the interval reports while iperf3 runs, which needs --json-stream
+JSON_STREAM_IPERF_VERSION = (3, 17)
 
-def get_iperf_metrics(filename):
+# iperf3 indents with tabs, so the top-level end key is the only one indented by exactly one tab
+_END_KEY = re.compile(rb'\n\t"end":\s*')
+_START_KEY = re.compile(rb'\n\t"start":\s*')
+_TAIL_SIZE = 64 * 1024
+# the RTT of a stream in an interval report and whether the interval is omitted. the end section only has the
+# min/mean/max RTTs, so this only matches the interval reports, which are read in chunks of this size
+_INTERVAL_RTT = re.compile(rb'"rtt":\s*(\d+),[^{}]*?"omitted":\s*(true|false)')
+_CHUNK_SIZE = 1024 * 1024
+# loading is spread across a process pool once there are this many files
+PARALLEL_LOAD_THRESHOLD = 64
+
+
+def load_iperf_end(filename):
+    # we only need to end, which is the last section of the file. with interval reports the whole
+    # document can be megabytes, so scan backwards for the end key and only decode that object
+    with open(filename, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        read_size = _TAIL_SIZE
+        while pos > 0:
+            read_size = min(read_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            tail = f.read(read_size) + tail
+            match = None
+            for match in _END_KEY.finditer(tail):
+                pass
+            if match is not None:
+                end, _ = json.JSONDecoder().raw_decode(tail[match.end():].decode())
+                return end
+            read_size *= 2
+    # not formatted by iperf3, e.g. compact JSON
+    with open(filename) as f:
+        data = json.load(f)
+    return data["end"]
+
+
+def load_iperf_start(filename):
+    # the start section comes first and is small
+    with open(filename, "rb") as f:
+        head = f.read(_TAIL_SIZE)
+    match = _START_KEY.search(head)
+    if match is not None:
+        try:
+            start, _ = json.JSONDecoder().raw_decode(head[match.end():].decode())
+            return start
+        except ValueError:
+            # cut off by the read size
+            pass
     with open(filename) as f:
         data = json.load(f)
-    # we only need to end
-    end = data["end"]
+    return data.get("start", {})
+
+
+# all metrics of a result, in the order of the tuples returned by get_result_metrics. RTTs are in ms, FCT in s
+latency_metric_names = ["min_rtt", "max_rtt", "rtt_p50", "rtt_p95", "rtt_p99"]
+fct_metric_names = ["fct", "slowdown"]
+metric_names = ["goodput", "mean_rtt", "retransmits"] + latency_metric_names + fct_metric_names
+
+
+def get_end_metrics(end, filename):
     if "sum_sent" not in end:
         print(f"Unable to find final stats for {filename}!", file=sys.stderr)
         return 0, 0, 0
@@ -19,42 +84,209 @@ def get_iperf_metrics(filename):
     sum_received = end["sum_received"]
     # this is the receiver's information
     goodput = sum_received["bits_per_second"]
-    # need to get mean RTT as well, which is the latency
+    # need to get mean RTT as well, which is the latency. iperf3 reports it in us
     stream = end["streams"][0]  # only one stream
     sender = stream["sender"]
-    mean_rtt = sum_received["seconds"]
+    mean_rtt = sender["mean_rtt"] / 1000 if "mean_rtt" in sender else None
     return goodput, mean_rtt, retransmits
 
 
-def get_all_metrics(dirname, split_host=False):
-    json_files = [os.path.join(dirname, fn) for fn in os.listdir(dirname) if fn.endswith(".json")]
+def get_iperf_metrics(filename):
+    return get_end_metrics(load_iperf_end(filename), filename)
+
+
+def is_complete_result(filename):
+    # iperf3 writes the final stats last, so results of interrupted runs don't have them or aren't valid JSON
+    try:
+        return "sum_sent" in load_iperf_end(filename)
+    except (OSError, ValueError):
+        return False
+
+
+def get_percentiles(values):
+    if len(values) < 2:
+        return None, None, None
+    import statistics
+    quantiles = statistics.quantiles(values, n=100, method="inclusive")
+    return quantiles[49], quantiles[94], quantiles[98]
+
+
+def get_rtt_samples(filename):
+    # RTT samples in us of the whole run after iperf3's omitted first second. TCP_INFO samples are preferred, the
+    # interval reports of --adaptive runs are the fallback
+    tcpinfo_filename = os.path.splitext(filename)[0] + ".tcpinfo"
+    if os.path.exists(tcpinfo_filename):
+        from tcpinfo import load_tcpinfo
+        samples = load_tcpinfo(tcpinfo_filename)
+        if len(samples) > 0:
+            return samples.srtt[samples.time >= samples.time[0] + 1].tolist()
+    return load_interval_rtts(filename)
+
+
+def load_interval_rtts(filename):
+    # the interval reports are most of the document, so scan them for the RTTs instead of decoding all of it
+    rtts = []
+    rest = b""
+    with open(filename, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            data = rest + chunk
+            last = 0
+            for match in _INTERVAL_RTT.finditer(data):
+                if match.group(2) == b"false":
+                    rtts.append(int(match.group(1)))
+                last = match.end()
+            if not chunk:
+                return rtts
+            # a stream report cut off by the chunk is scanned again with the next one, from its opening brace
+            rest = data[max(last, data.rfind(b"{")):]
+
+
+def get_latency_metrics(end, filename):
+    """min/max RTT of the sender stream and the RTT percentiles, in ms. Percentiles are None unless the run has
+    TCP_INFO samples or interval reports"""
+    sender = end["streams"][0]["sender"] if end.get("streams") else {}
+    min_rtt = sender["min_rtt"] / 1000 if "min_rtt" in sender else None
+    max_rtt = sender["max_rtt"] / 1000 if "max_rtt" in sender else None
+    percentiles = [None if p is None else p / 1000 for p in get_percentiles(get_rtt_samples(filename))]
+    return (min_rtt, max_rtt) + tuple(percentiles)
+
+
+def get_fct_metrics(start, end, config):
+    """Flow completion time in s of --total-size runs, and its slowdown over the ideal size/bw + RTT of the config.
+    None for time based runs, and the slowdown is None if the config is unknown"""
+    if start.get("test_start", {}).get("bytes", 0) == 0 or "sum_received" not in end:
+        return None, None
+    received = end["sum_received"]
+    # runs from before -n stopped omitting the first second sent that second on top of the total size, and the end
+    # stats leave it out. both the FCT and the ideal time are of the bytes after it
+    fct = received["seconds"]
+    if config is None:
+        return fct, None
+    ideal = received["bytes"] * 8 / (config.bw * 1e6) + config.rtt / 1000
+    return fct, fct / ideal
+
+
+def get_result_metrics(filename):
+    end = load_iperf_end(filename)
+    try:
+        config = parse_name_config(get_result_name(filename))
+    except (AssertionError, IndexError, ValueError):
+        config = None
+    return get_end_metrics(end, filename) + get_latency_metrics(end, filename) + \
+        get_fct_metrics(load_iperf_start(filename), end, config)
+
+
+def parallel_map(func, items):
+    # cold loads of large directories are CPU bound on JSON decoding, so use all the cores
+    items = list(items)
+    if len(items) < PARALLEL_LOAD_THRESHOLD:
+        return [func(item) for item in items]
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+        return list(pool.map(func, items, chunksize=16))
+
+
+def get_run_duration(filename):
+    # how long the test actually transmitted. runs with --adaptive may stop before the configured time
+    with open(filename) as f:
+        data = json.load(f)
+    if "adaptive" in data:
+        return data["adaptive"]["duration"]
+    return data["end"]["sum_sent"]["seconds"]
+
+
+def get_run_records(dirname):
+    # what the experiments appended to runs.jsonl, e.g. readiness latency and queue delay, merged by result name
+    records = {}
+    filename = os.path.join(dirname, "runs.jsonl")
+    if not os.path.exists(filename):
+        return records
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                records.setdefault(record["name"], {}).update(record)
+    return records
+
+
+def append_run_record(dirname, name, **fields):
+    line = json.dumps({"name": name, "time": time.time(), **fields}) + "\n"
+    # a single append is atomic, so parallel jobs can share the file
+    with open(os.path.join(dirname, "runs.jsonl"), "a") as f:
+        f.write(line)
+
+
+def append_journal(dirname, name, state, **fields):
+    # the state of every experiment of a sweep, one JSON line per change: planned, running, done or failed
+    line = json.dumps({"name": name, "time": time.time(), "state": state, **fields}) + "\n"
+    # a single append is atomic, so parallel jobs can share the file
+    with open(os.path.join(dirname, "journal.jsonl"), "a") as f:
+        f.write(line)
+
+
+def get_journal_records(dirname):
+    # every state change in journal.jsonl, in order
+    records = []
+    filename = os.path.join(dirname, "journal.jsonl")
+    if not os.path.exists(filename):
+        return records
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def get_journal(dirname):
+    # the last state of every experiment in journal.jsonl
+    return {record["name"]: record for record in get_journal_records(dirname)}
+
+
+def get_jain_index(values):
+    # Jain's fairness index. 1 when every flow gets the same goodput, 1/n when one flow takes everything
+    values = list(values)
+    squares = sum(v * v for v in values)
+    if squares == 0:
+        return 0
+    return sum(values) ** 2 / (len(values) * squares)
+
+
+def get_all_metrics(dirname, split_host=False, use_index=True):
+    if use_index:
+        # look up the results index instead of parsing every file again
+        import resultdb
+        metrics = {row["name"]: tuple(row[name] for name in metric_names) for row in resultdb.get_results(dirname)}
+    else:
+        json_files = [os.path.join(dirname, fn) for fn in os.listdir(dirname) if fn.endswith(".json")]
+        values = parallel_map(get_result_metrics, json_files)
+        metrics = {os.path.splitext(os.path.basename(fn))[0]: value for fn, value in zip(json_files, values)}
+
     if split_host:
-        result = {}
-        for filename in json_files:
-            fn = os.path.basename(filename)
-            name = os.path.splitext(fn)[0]
-            host = name.split("-")[0]
-            if host not in result:
-                result[host] = {}
-            metric = get_iperf_metrics(filename)
-            result[host][name] = metric
-        array_result = []
-        keys = list(result.keys())
-        keys.sort()
-        for host in keys:
-            array_result.append(result[host])
-        return array_result
+        return split_metrics_by_host(metrics)
     else:
-        result = {}
-        for filename in json_files:
-            fn = os.path.basename(filename)
-            name = os.path.splitext(fn)[0]
-            metric = get_iperf_metrics(filename)
-            result[name] = metric
-        return result
+        return metrics
+
+
+def split_metrics_by_host(metrics):
+    result = {}
+    for name, metric in metrics.items():
+        host = name.split("-")[0]
+        if host not in result:
+            result[host] = {}
+        result[host][name] = metric
+    array_result = []
+    keys = list(result.keys())
+    # h10 comes after h9
+    keys.sort(key=lambda host: (len(host), host))
+    for host in keys:
+        array_result.append(result[host])
+    return array_result
 
 
-config_param_names = ["hostname", "buffer_size", "rtt", "bw", "loss"]
+config_param_names = ["hostname", "buffer_size", "rtt", "bw", "loss", "repetition"]
 ExperimentConfig = collections.namedtuple("ExperimentConfig", config_param_names)
 
 
@@ -73,7 +305,25 @@ def parse_name_config(name):
     loss_token = tokens[4]
     assert loss_token[0] == "l"
     loss = float(loss_token[1:])
-    return ExperimentConfig(hostname=hostname, buffer_size=buffer_size, rtt=rtt, bw=bw, loss=loss)
+    # repetitions after the first one have a -r<k> suffix
+    repetition = 0
+    if len(tokens) > 5:
+        repetition_token = tokens[5]
+        assert repetition_token[0] == "r"
+        repetition = int(repetition_token[1:])
+    return ExperimentConfig(hostname=hostname, buffer_size=buffer_size, rtt=rtt, bw=bw, loss=loss,
+                            repetition=repetition)
+
+
+def get_sender_names(num_senders):
+    # h3 is the receiver
+    names = []
+    i = 1
+    while len(names) < num_senders:
+        if i != 3:
+            names.append(f"h{i}")
+        i += 1
+    return names
 
 
 def get_filename(node, configs):
@@ -82,7 +332,19 @@ def get_filename(node, configs):
     rtt = configs.rtt
     bw = configs.bw
     loss = configs.loss
-    return os.path.join(configs.output, f"{name}-b{buffer_size}-rtt{rtt}-bw{bw}-l{loss}.json")
+    # the first repetition keeps the name of results from before repetitions
+    repetition = getattr(configs, "repetition", 0)
+    suffix = f"-r{repetition}" if repetition > 0 else ""
+    return os.path.join(configs.output, f"{name}-b{buffer_size}-rtt{rtt}-bw{bw}-l{loss}{suffix}.json")
+
+
+def get_temp_filename(filename):
+    # where a run writes its result until it is complete. the result loaders only read *.json
+    return filename + ".part"
+
+
+def get_result_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
 
 
 def get_available_cc():
@@ -91,6 +353,34 @@ def get_available_cc():
     return values.split()
 
 
+def check_available_cc(parser, ccs):
+    # validated after parsing instead of through choices, so that --help and argument errors
+    # don't need to read /proc
+    available = get_available_cc()
+    for cc in ccs:
+        if cc not in available:
+            parser.error(f"congestion control {cc} is not available, choose from {', '.join(available)}")
+
+
+def get_iperf_version():
+    import subprocess
+    try:
+        output = subprocess.run(["iperf3", "--version"], capture_output=True, text=True).stdout
+    except FileNotFoundError:
+        return None
+    # e.g. iperf 3.17.1 (cJSON 1.7.15)
+    match = re.search(r"iperf (\d+)\.(\d+)", output)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def check_json_stream(parser):
+    version = get_iperf_version()
+    if version is None or version < JSON_STREAM_IPERF_VERSION:
+        found = "no iperf3" if version is None else f"iperf3 {version[0]}.{version[1]}"
+        parser.error(f"--adaptive needs iperf3 {'.'.join(map(str, JSON_STREAM_IPERF_VERSION))} or newer for "
+                     f"--json-stream, found {found}")
+
+
 def __main():
     if len(sys.argv) == 2:
         if sys.argv[1].endswith(".json"):
@@ -99,10 +389,26 @@ def __main():
         else:
             data = get_all_metrics(sys.argv[1])
             assert len(data) > 0, f"{sys.argv[1]} empty!"
+            records = get_run_records(sys.argv[1])
             for name, metric in data.items():
                 config = parse_name_config(name)
-                goodput, mean_rtt, retransmits = metric
-                print(config, f"Goodput: {goodput} Mean RTT: {mean_rtt} Retr: {retransmits}")
+                goodput, mean_rtt, retransmits = metric[:3]
+                line = f"Goodput: {goodput} Mean RTT: {mean_rtt} Retr: {retransmits}"
+                fct, slowdown = metric[len(metric_names) - len(fct_metric_names):]
+                if fct is not None:
+                    line += f" FCT: {fct:.3f} s Slowdown: {slowdown:.2f}"
+                record = records.get(name, {})
+                if "queue_delay_p50" in record:
+                    line += " Queue delay p50/p95/p99: {0:.2f}/{1:.2f}/{2:.2f} ms".format(
+                        record["queue_delay_p50"], record["queue_delay_p95"], record["queue_delay_p99"])
+                if "jain_index" in record:
+                    line += " Aggregate goodput: {0:.2f} Jain's index: {1:.3f}".format(record["aggregate_goodput"],
+                                                                                   record["jain_index"])
+                if "variant" in record:
+                    params = " ".join(f"{key}={'/'.join(map(str, value)) if isinstance(value, list) else value}"
+                                      for key, value in record["variant_params"].items())
+                    line += f" Variant: {record['variant']} ({params or 'upstream'})"
+                print(config, line)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# sweep worker that runs on the emulation hosts. it takes leased experiments from coordinator.py, one JSON request
+# per line on stdin, and answers with heartbeats while the experiment runs and with the result files at the end
+# usage: worker.py
+#
+# request:  {"lease": 1, "commands": ["sudo", "python3", "bbr.py", "-o", "/tmp/bbr_worker_1", ...],
+#            "output": "/tmp/bbr_worker_1", "heartbeat": 10}
+# response: {"lease": 1, "event": "heartbeat"}
+#           {"lease": 1, "event": "done", "returncode": 0, "files": {"h1-b0.1-rtt5-bw10-l0.json": "<base64>"}}
+# this file is copied to the remote machines, so it only uses the standard library
+
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+
+# how long an experiment that is stopped gets to clean up before it is killed, in s
+STOP_TIMEOUT = 30
+
+
+class Worker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process = None
+
+    def send(self, response):
+        # heartbeats come from another thread
+        with self.lock:
+            sys.stdout.write(json.dumps(response) + "\n")
+            sys.stdout.flush()
+
+    def run(self, request):
+        lease = request["lease"]
+        output = request["output"]
+        if os.path.exists(output):
+            shutil.rmtree(output)
+        os.makedirs(output)
+        # stdout is the connection to the coordinator, so the experiment logs go to stderr
+        self.process = subprocess.Popen(request["commands"], stdin=subprocess.DEVNULL, stdout=sys.stderr)
+        while True:
+            try:
+                returncode = self.process.wait(timeout=request["heartbeat"])
+                break
+            except subprocess.TimeoutExpired:
+                self.send({"lease": lease, "event": "heartbeat"})
+        self.process = None
+        files = {}
+        if returncode == 0:
+            for name in sorted(os.listdir(output)):
+                with open(os.path.join(output, name), "rb") as f:
+                    files[name] = base64.b64encode(f.read()).decode()
+        shutil.rmtree(output, ignore_errors=True)
+        self.send({"lease": lease, "event": "done", "returncode": returncode, "files": files})
+
+    def serve(self):
+        thread = None
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            request = json.loads(line)
+            # one experiment at a time. the coordinator only sends the next one after the last one is done
+            if thread is not None:
+                thread.join()
+            thread = threading.Thread(target=self.run, args=(request,), daemon=True)
+            thread.start()
+        # the coordinator is gone, e.g. the ssh connection dropped or the lease was lost. the lease will be run
+        # somewhere else, and possibly in the same job slot of this host, so the experiment cleans up after itself
+        process = self.process
+        if process is not None:
+            # sudo passes SIGTERM on to bbr.py
+            process.terminate()
+            try:
+                process.wait(timeout=STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def main():
+    Worker().serve()
+
+
+if __name__ == "__main__":
+    main()